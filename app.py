@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 import logging
 
@@ -6,9 +7,17 @@ from fastapi import FastAPI, Request
 import uvicorn
 
 from bot import bot, dp
-from config import TELEGRAM_BOT_TOKEN
+from config import JOB_CONCURRENCY, TELEGRAM_BOT_TOKEN, WEB_CONCURRENCY
+from utils.http_session import close_session
+from utils.job_queue import enqueue_job, prune_jobs, run_job_worker
+from utils.media_store import prune_job_dirs
 from utils.ngrok import get_ngrok_url
-
+from utils.shared_state import (
+    is_update_seen,
+    mark_update_seen,
+    try_acquire_lock,
+)
+from utils.worker_pool import worker_pool
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -18,13 +27,65 @@ logger = logging.getLogger(__name__)
 NGROK_TUNNEL_URL = get_ngrok_url()
 WEBHOOK_PATH = f"/bot/{TELEGRAM_BOT_TOKEN}"
 WEBHOOK_URL = f"{NGROK_TUNNEL_URL}{WEBHOOK_PATH}"
-# Set to store processed update_ids
-processed_update_ids = set()
+# How long in seconds one app process owns the webhook setup, so that
+# processes starting together don't drop each other's webhook
+WEBHOOK_SETUP_LOCK_TTL = 300
+# One lock per tunnel URL, so an app restarted with a new URL sets up
+# its webhook right away
+WEBHOOK_SETUP_LOCK = f"webhook-setup:{NGROK_TUNNEL_URL}"
+# Wakes up idle job workers when an update is enqueued
+jobs_available = asyncio.Event()
+
+
+def get_update_user_id(update: dict) -> int | None:
+    """
+    Get the ID of the user who sent an update, if any.
+
+    Args:
+        update (dict): The update as received from Telegram.
+
+    Returns:
+        int | None: The user ID.
+    """
+    for content in update.values():
+        if isinstance(content, dict) and "from" in content:
+            return content["from"].get("id")
+    return None
+
+
+def get_update_chat_id(update: dict) -> int | None:
+    """
+    Get the ID of the chat an update came from, if any.
+
+    Args:
+        update (dict): The update as received from Telegram.
+
+    Returns:
+        int | None: The chat ID.
+    """
+    for content in update.values():
+        if isinstance(content, dict) and "chat" in content:
+            return content["chat"].get("id")
+    return None
+
+
+async def handle_update_job(payload: dict) -> None:
+    update = types.Update(**payload)
+    await dp.feed_update(bot, update)
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Startup logic
+async def handle_failed_job(payload: dict) -> None:
+    chat_id = get_update_chat_id(payload)
+    if chat_id is None:
+        return
+    await bot.send_message(
+        chat_id,
+        "Sorry, your request could not be completed. Please try again "
+        "later.",
+    )
+
+
+async def setup_webhook() -> None:
     # Remove webhook if it exists
     delete_webhook_result = await bot.delete_webhook(drop_pending_updates=True)
     if delete_webhook_result:
@@ -40,11 +101,47 @@ async def lifespan(app: FastAPI):
     else:
         logger.info(f"Webhook URL is already set to {WEBHOOK_URL}")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup logic
+    # Only one of the app processes sets up the webhook
+    is_setup_owner = await asyncio.to_thread(
+        try_acquire_lock, WEBHOOK_SETUP_LOCK, WEBHOOK_SETUP_LOCK_TTL
+    )
+    if is_setup_owner:
+        await setup_webhook()
+    else:
+        logger.info("Webhook is set up by another app process")
+
+    # Jobs interrupted by a crash or redeploy are resumed once their
+    # lease expires, skipping what they already delivered
+    pruned_jobs = await asyncio.to_thread(prune_jobs)
+    if pruned_jobs:
+        logger.info(f"Removed {pruned_jobs} old jobs")
+    await asyncio.to_thread(prune_job_dirs)
+
+    job_workers = [
+        asyncio.create_task(
+            run_job_worker(
+                handle_update_job, jobs_available, handle_failed_job
+            )
+        )
+        for _ in range(JOB_CONCURRENCY)
+    ]
+
     yield
 
     # Shutdown logic
+    for job_worker in job_workers:
+        job_worker.cancel()
+    await asyncio.gather(*job_workers, return_exceptions=True)
+    logger.info("Job workers stopped")
     await bot.session.close()
     logger.info("Bot session closed")
+    await close_session()
+    worker_pool.shutdown()
+    logger.info("Worker processes stopped")
 
 
 # Initialize FastAPI app
@@ -56,22 +153,26 @@ async def bot_webhook(request: Request):
     update = await request.json()
     update_id = update["update_id"]
 
-    # Check if update_id is already processed
-    if update_id in processed_update_ids:
+    # Telegram redelivers updates it got no timely answer for, possibly
+    # to another app process. The shared seen-updates window and the
+    # job's idempotency key make sure each one runs only once. The
+    # update is marked as seen only once its job is stored, so a failed
+    # enqueue is retried on the next redelivery.
+    is_new = not await asyncio.to_thread(is_update_seen, update_id)
+    if is_new:
+        user_id = get_update_user_id(update)
+        is_new = await asyncio.to_thread(
+            enqueue_job, f"update:{update_id}", update, user_id
+        )
+        await asyncio.to_thread(mark_update_seen, update_id)
+    if not is_new:
         logger.info(f"Ignoring already processed update: {update_id}")
         return {"ok": True}
 
     logger.info(f"Received update: {update_id}")
-    processed_update_ids.add(update_id)
-
-    # Remove old update_ids to prevent memory leaks
-    if len(processed_update_ids) > 20:
-        processed_update_ids.clear()
-
-    update = types.Update(**update)
-    await dp.feed_update(bot, update)
+    jobs_available.set()
     return {"ok": True}
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=WEB_CONCURRENCY)
@@ -1,34 +1,66 @@
+import asyncio
 import logging
-import os
+from dataclasses import dataclass
+from typing import AsyncIterable, AsyncIterator
 
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 
-from config import TELEGRAM_API_BASE_URL, TELEGRAM_BOT_TOKEN
-from utils.file_utils import create_zip_file, send_file_to_user
-from utils.message_utils import update_progress
+from config import (
+    ARCHIVE_PART_SIZE_MB,
+    ARCHIVE_STREAMING,
+    TELEGRAM_API_BASE_URL,
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_UPLOAD_LIMIT_MB,
+    WEB_CONCURRENCY,
+)
+from utils.file_id_cache import get_archive_key, get_track_key
+from utils.file_utils import (
+    ArchiveVolumes,
+    send_cached_file,
+    send_file_to_user,
+)
+from utils.job_queue import get_job_deliveries, record_job_deliveries
+from utils.media_store import create_job_dir, remove_job_dir
+from utils.message_utils import ProgressReporter, update_progress
+from utils.playlist_sync import get_playlist_sync, save_playlist_sync
 from utils.spotify.album_utils import (
+    get_album_data,
     get_album_id_by_url,
     get_album_title,
     get_album_tracks,
 )
 from utils.spotify.auth import get_auth_header, get_token
 from utils.spotify.playlist_utils import (
+    get_playlist_details,
     get_playlist_id_by_url,
-    get_playlist_title,
-    get_playlist_tracks,
+    get_new_playlist_items,
     is_playlist_accessible,
+    iter_playlist_tracks,
 )
 from utils.spotify.track_utils import (
     get_track,
     get_track_id_by_url,
     get_track_info,
+    get_tracks_info,
 )
-from utils.telegram_api_bot_server import check_telegram_bot_api_server
-from utils.track_processor import process_track
-
+from utils.telegram_api_bot_server import (
+    HOSTED_API_UPLOAD_LIMIT,
+    LOCAL_API_UPLOAD_LIMIT,
+    check_telegram_bot_api_server,
+)
+from utils.telegram_scheduler import OutboundScheduler
+from utils.track_pipeline import (
+    TrackResult,
+    get_job_output_format,
+    get_results_summary,
+    process_tracks,
+    run_track,
+)
+from utils.track_processor import get_track_filename
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -45,8 +77,22 @@ if check_telegram_bot_api_server(
     # Initialize bot with custom session pointing
     # to the local telegram-bot-api server
     bot = Bot(token=TELEGRAM_BOT_TOKEN, session=session)  # type: ignore
+    upload_limit = LOCAL_API_UPLOAD_LIMIT
 else:
     bot = Bot(token=TELEGRAM_BOT_TOKEN)  # type: ignore
+    upload_limit = HOSTED_API_UPLOAD_LIMIT
+
+# Send all chat-bound calls through the rate-limited outbound queue.
+# Every app process gets its share of the bot's global rate limit.
+bot.session.middleware(
+    OutboundScheduler(global_rate=TELEGRAM_GLOBAL_RATE / WEB_CONCURRENCY)
+)
+
+if TELEGRAM_UPLOAD_LIMIT_MB:
+    upload_limit = TELEGRAM_UPLOAD_LIMIT_MB * 1024 * 1024
+
+# Archives are sent in parts no larger than this
+ARCHIVE_PART_SIZE = min(ARCHIVE_PART_SIZE_MB * 1024 * 1024, upload_limit)
 
 dp = Dispatcher()
 
@@ -68,28 +114,263 @@ async def handle_spotify_track_url(message: types.Message) -> None:
         )
 
     track_url = message.text.strip()  # type: ignore
-    token = get_token()
-    headers = get_auth_header(token)
     track_id = get_track_id_by_url(track_url)
-    json_result = get_track(headers, track_id)
-    track_info = get_track_info(headers, json_result)
-    track_dir = "media/tracks"
+    cache_key = get_track_key(track_id)
+
+    # A resumed job doesn't send the track again
+    if cache_key in await get_job_deliveries():
+        logger.info("Track was sent by an earlier attempt.")
+        return
+
+    # Resend an earlier upload of the same track without any processing
+    if await send_cached_file(message, cache_key, "audio"):
+        logger.info("Track was sent from cache.")
+        await record_job_deliveries([cache_key])
+        return
+
+    token = await get_token()
+    headers = get_auth_header(token)
+    json_result = await get_track(headers, track_id)
+    track_info = await get_track_info(headers, json_result)
 
     bot_message = await message.answer("Starting to process track...")
     bot_message_id = bot_message.message_id
     chat_id = bot_message.chat.id
 
-    track_path = process_track(track_info, track_dir)
-    if track_path:
+    user_id = message.from_user.id if message.from_user else None
+    track_dir = await asyncio.to_thread(
+        create_job_dir, "media/tracks", track_id
+    )
+    try:
+        result = await run_track(
+            track_info, track_dir, user_id=user_id, priority=True
+        )
+        track_path = result.track_path
+        if track_path:
+            # Indicate that the bot is sending a document
+            await bot.send_chat_action(chat_id, "upload_document")
+
+            file = types.FSInputFile(
+                track_path, get_track_filename(track_info)
+            )
+            if await send_file_to_user(message, file, "audio", cache_key):
+                await record_job_deliveries([cache_key])
+            progress_text = "Track was sent."
+        else:
+            progress_text = "Track wasn't found."
+    finally:
+        await asyncio.to_thread(remove_job_dir, track_dir)
+    logger.info(progress_text)
+    await update_progress(
+        bot, progress_text, chat_id, bot_message_id, final=True
+    )
+
+
+@dataclass
+class ArchiveDelivery:
+    """
+    Outcome of sending the tracks of a playlist or album.
+    """
+
+    # Tracks processed by this attempt of the job
+    results: list[TrackResult]
+    # Tracks the user received, including from earlier attempts
+    delivered_ids: list[str]
+    # Whether every track reached the user
+    complete: bool
+
+
+async def _skip_delivered(
+    tracks_info: AsyncIterable[dict], delivered: set[str], skipped: list
+) -> AsyncIterator[dict]:
+    async for track_info in tracks_info:
+        if track_info.get("id") in delivered:
+            skipped.append(track_info["id"])
+        else:
+            yield track_info
+
+
+async def send_tracks_archive(
+    message: types.Message,
+    kind: str,
+    source_id: str,
+    title: str,
+    tracks_info: list | AsyncIterable[dict],
+    total: int | None = None,
+) -> ArchiveDelivery:
+    """
+    Download the tracks of a playlist or album and send them to the user
+    as ZIP archives.
+
+    Finished tracks are collected into numbered, size-capped parts, and
+    each part is sent as soon as it is full, while the rest are still
+    downloading. With ARCHIVE_STREAMING, each part is assembled during
+    the upload itself. Tracks are hard-linked from the track cache into
+    a private job directory, which is removed when the job is done.
+    A resumed job skips the tracks its earlier attempts delivered.
+
+    Args:
+        message (types.Message): The message with the Spotify URL.
+        kind (str): Either 'playlist' or 'album'.
+        source_id (str): Spotify ID of the playlist or album.
+        title (str): Title of the playlist or album.
+        tracks_info (list | AsyncIterable[dict]): Information about the
+        tracks to download, possibly still arriving.
+        total (int | None): Expected number of tracks, required when
+        tracks_info is an async iterator.
+
+    Returns:
+        ArchiveDelivery: What was delivered.
+    """
+    # Directory to store downloaded tracks, removed when the job is done
+    tracks_dir = await asyncio.to_thread(
+        create_job_dir, f"media/{kind}s", source_id
+    )
+    try:
+        return await _send_tracks_archive(
+            message,
+            kind,
+            source_id,
+            title,
+            tracks_info,
+            len(tracks_info) if total is None else total,  # type: ignore
+            tracks_dir,
+        )
+    finally:
+        await asyncio.to_thread(remove_job_dir, tracks_dir)
+
+
+async def _send_tracks_archive(
+    message: types.Message,
+    kind: str,
+    source_id: str,
+    title: str,
+    tracks_info: list | AsyncIterable[dict],
+    total: int,
+    tracks_dir: str,
+) -> ArchiveDelivery:
+    # Very large jobs may use a cheaper output format
+    output_format = get_job_output_format(total)
+
+    delivered = await get_job_deliveries()
+    skipped: list[str] = []
+    if delivered:
+        if isinstance(tracks_info, list):
+            skipped = [
+                info["id"]
+                for info in tracks_info
+                if info.get("id") in delivered
+            ]
+            tracks_info = [
+                info for info in tracks_info if info.get("id") not in delivered
+            ]
+            total = len(tracks_info)
+        else:
+            tracks_info = _skip_delivered(tracks_info, delivered, skipped)
+            total = max(0, total - len(delivered))
+
+    bot_message = await message.answer("Starting to process tracks...")
+    chat_id = bot_message.chat.id
+    progress = ProgressReporter(bot, chat_id, bot_message.message_id)
+
+    async def send_volume(
+        file: types.InputFile, track_ids: list, number: int
+    ) -> bool:
         # Indicate that the bot is sending a document
         await bot.send_chat_action(chat_id, "upload_document")
 
-        await send_file_to_user(message, track_path, "audio")
-        progress_text = "Track was sent."
-    else:
-        progress_text = "Track wasn't found."
+        logger.info(f"Sending part {number} of {kind}: {title}")
+        archive_key = get_archive_key(
+            kind, source_id, track_ids, output_format
+        )
+        if not await send_file_to_user(message, file, "document", archive_key):
+            return False
+        await record_job_deliveries(list(filter(None, track_ids)))
+        return True
+
+    async def send_cached_volume(track_ids: list, number: int) -> bool:
+        archive_key = get_archive_key(
+            kind, source_id, track_ids, output_format
+        )
+        if not await send_cached_file(message, archive_key, "document"):
+            return False
+        logger.info(f"Sent part {number} of {kind} from cache: {title}")
+        await record_job_deliveries(list(filter(None, track_ids)))
+        return True
+
+    volumes = ArchiveVolumes(
+        tracks_dir,
+        title,
+        ARCHIVE_PART_SIZE,
+        send_volume,
+        streaming=ARCHIVE_STREAMING,
+        send_cached=send_cached_volume,
+    )
+
+    # Tracks that finished, in case the job stops partway through
+    finished_results: list[TrackResult] = []
+
+    async def report_result(
+        result: TrackResult, finished: int, total: int
+    ) -> None:
+        finished_results.append(result)
+        if result.ok:
+            await volumes.add(
+                result.track_path,  # type: ignore
+                result.track_info["id"],
+                get_track_filename(result.track_info, output_format),
+            )
+        status = "Processed" if result.ok else "Failed"
+        progress_text = f"{status} track {finished}/{total}: {result.name}"
+        progress.set_progress(finished, total, progress_text)
+
+    user_id = message.from_user.id if message.from_user else None
+    walk_failed = False
+    try:
+        results = await process_tracks(
+            tracks_info,
+            tracks_dir,
+            report_result,
+            user_id=user_id,
+            output_format=output_format,
+            total=total,
+        )
+    except Exception as e:
+        # The tracks that finished are still sent
+        logger.error(f"Failed to fetch all tracks of {kind} {source_id}: {e}")
+        results = finished_results
+        walk_failed = True
+    walk_error = (
+        f"Could not fetch all tracks of the {kind}.\n" if walk_failed else ""
+    )
+
+    summary = get_results_summary(results)
+    logger.info(summary)
+    if not results and skipped and not walk_failed:
+        await progress.finish(f"{kind.capitalize()} was sent.")
+        return ArchiveDelivery(results, skipped, True)
+    if not any(result.ok for result in results):
+        await progress.finish(
+            f"{walk_error}No tracks could be downloaded.\n{summary}"
+        )
+        return ArchiveDelivery(results, skipped, False)
+
+    progress.update(f"{kind.capitalize()} was downloaded. Sending...")
+    await volumes.close()
+
+    progress_text = f"{kind.capitalize()} was sent"
+    if volumes.volumes_sent > 1:
+        progress_text += f" in {volumes.volumes_sent} parts"
+    if volumes.volumes_failed:
+        progress_text += f", {volumes.volumes_failed} parts could not be sent"
+    progress_text += f".\n{walk_error}{summary}"
     logger.info(progress_text)
-    await update_progress(bot, progress_text, chat_id, bot_message_id)
+    await progress.finish(progress_text)
+    return ArchiveDelivery(
+        results,
+        skipped + volumes.delivered_keys,
+        not walk_failed and len(volumes.delivered_keys) == len(results),
+    )
 
 
 @dp.message(F.text.startswith("https://open.spotify.com/playlist/"))
@@ -103,67 +384,87 @@ async def handle_spotify_playlist_url(message: types.Message) -> None:
         )
 
     playlist_url = message.text.strip()  # type: ignore
-    token = get_token()
+    token = await get_token()
     headers = get_auth_header(token)
     playlist_id = get_playlist_id_by_url(playlist_url)
 
     # Check if the playlist is not private
-    if not is_playlist_accessible(headers, playlist_id):
+    if not await is_playlist_accessible(headers, playlist_id):
         logger.info(f"Received private playlist with id: {playlist_id}")
         await message.answer("The playlist is private or inaccessible.")
         return
 
-    playlist_title = get_playlist_title(headers, playlist_id)
-    tracks_info = get_playlist_tracks(headers, playlist_id)
-    if len(tracks_info) == 0:
+    playlist = await get_playlist_details(headers, playlist_id)
+    playlist_title = playlist["name"]
+    snapshot_id = playlist.get("snapshot_id")
+
+    # What the user got from this playlist before, if anything
+    user_id = message.from_user.id if message.from_user else None
+    sync = None
+    if user_id is not None:
+        sync = await asyncio.to_thread(get_playlist_sync, user_id, playlist_id)
+    if sync and snapshot_id and sync.snapshot_id == snapshot_id:
+        logger.info(f"Playlist {playlist_id} is unchanged for {user_id}")
+        await message.answer(
+            "The playlist hasn't changed since you last received it."
+        )
+        return
+
+    total = playlist.get("tracks", {}).get("total", 0)
+    if total == 0:
         logger.warning("Tracks info is empty")
         await message.answer("No tracks found in the playlist.")
         return
 
-    # Directory to store downloaded tracks
-    tracks_dir = f"media/playlists/{playlist_title}"
-    os.makedirs(tracks_dir, exist_ok=True)
-
-    bot_message = await message.answer("Starting to process tracks...")
-    bot_message_id = bot_message.message_id
-    chat_id = bot_message.chat.id
-    total_tracks = len(tracks_info)
-
-    for current, track_info in enumerate(tracks_info):
-        progress_text = f"Processing track {current + 1}/{total_tracks}: {track_info['artists']} - {track_info['title']}"  # noqa: E501
-        await update_progress(
-            bot,
-            progress_text,
-            chat_id,
-            bot_message_id,
+    if sync:
+        # Only tracks added since the last time are delivered
+        json_results, playlist_ids = await get_new_playlist_items(
+            headers, playlist_id, sync.track_ids
         )
-        process_track(track_info, tracks_dir)
+        # The listing is complete here, a page that fails to load raises
+        # before any sync is saved
+        known_ids = sync.track_ids & playlist_ids
+        if not json_results:
+            logger.info(f"No new tracks in {playlist_id} for {user_id}")
+            await asyncio.to_thread(
+                save_playlist_sync,
+                user_id,  # type: ignore
+                playlist_id,
+                snapshot_id,
+                known_ids,
+            )
+            await message.answer(
+                "No new tracks since you last received the playlist."
+            )
+            return
+
+        logger.info(f"Sending {len(json_results)} new tracks of {playlist_id}")
+        await message.answer(
+            f"Found {len(json_results)} new tracks since you last "
+            "received the playlist."
+        )
+        playlist_title = f"{playlist_title} (new tracks)"
+        tracks_info = await get_tracks_info(headers, json_results)
+        total = len(tracks_info)
+    else:
+        known_ids = set()
+        # Downloads start while the later pages are still being fetched
+        tracks_info = iter_playlist_tracks(headers, playlist_id)
 
-    await update_progress(
-        bot,
-        "Playlist was downloaded. Sending...",
-        chat_id,
-        bot_message_id,
+    delivery = await send_tracks_archive(
+        message, "playlist", playlist_id, playlist_title, tracks_info, total
     )
 
-    # Indicate that the bot is sending a document
-    await bot.send_chat_action(chat_id, "upload_document")
-
-    # Create ZIP file
-    zip_path = f"media/playlists/{playlist_title}.zip"
-    create_zip_file(tracks_dir, zip_path)
-
-    # Send ZIP file to the user
-    await send_file_to_user(message, zip_path, "document")
-
-    progress_text = "Playlist was sent."
-    logger.info(progress_text)
-    await update_progress(
-        bot,
-        progress_text,
-        chat_id,
-        bot_message_id,
-    )
+    if user_id is not None:
+        # Only tracks in parts that reached the user count as received
+        known_ids |= set(filter(None, delivery.delivered_ids))
+        await asyncio.to_thread(
+            save_playlist_sync,
+            user_id,
+            playlist_id,
+            snapshot_id if delivery.complete else None,
+            known_ids,
+        )
 
 
 @dp.message(F.text.startswith("https://open.spotify.com/album/"))
@@ -177,59 +478,19 @@ async def handle_spotify_album_url(message: types.Message) -> None:
         )
 
     album_url = message.text.strip()  # type: ignore
-    token = get_token()
+    token = await get_token()
     headers = get_auth_header(token)
     album_id = get_album_id_by_url(album_url)
-    album_title = get_album_title(headers, album_id)
-    tracks_info = get_album_tracks(headers, album_id)
+    album_data = await get_album_data(headers, album_id)
+    album_title = get_album_title(album_data)
+    tracks_info = await get_album_tracks(headers, album_data)
     if len(tracks_info) == 0:
         logger.warning("Tracks info is empty")
         await message.answer("No tracks found in the album.")
         return
 
-    # Directory to store downloaded tracks
-    tracks_dir = f"media/albums/{album_title}"
-    os.makedirs(tracks_dir, exist_ok=True)
-
-    bot_message = await message.answer("Starting to process tracks...")
-    bot_message_id = bot_message.message_id
-    chat_id = bot_message.chat.id
-    total_tracks = len(tracks_info)
-
-    for current, track_info in enumerate(tracks_info):
-        progress_text = f"Processing track {current + 1}/{total_tracks}: {track_info['artists']} - {track_info['title']}"  # noqa: E501
-        await update_progress(
-            bot,
-            progress_text,
-            chat_id,
-            bot_message_id,
-        )
-        process_track(track_info, tracks_dir)
-
-    await update_progress(
-        bot,
-        "Album was downloaded. Sending...",
-        chat_id,
-        bot_message_id,
-    )
-
-    # Indicate that the bot is sending a document
-    await bot.send_chat_action(chat_id, "upload_document")
-
-    # Create ZIP file
-    zip_path = f"media/albums/{album_title}.zip"
-    create_zip_file(tracks_dir, zip_path)
-
-    # Send ZIP file to the user
-    await send_file_to_user(message, zip_path, "document")
-
-    progress_text = "Album was sent."
-    logger.info(progress_text)
-    await update_progress(
-        bot,
-        progress_text,
-        chat_id,
-        bot_message_id,
+    await send_tracks_archive(
+        message, "album", album_id, album_title, tracks_info
     )
 
 
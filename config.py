@@ -36,3 +36,151 @@ YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
 assert (
     YOUTUBE_API_KEY is not None
 ), "YOUTUBE_API_KEY environment variable is not set"
+
+# Optional tuning of the shared outbound HTTP connection pool
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+
+# Maximum number of concurrent requests to the Spotify Web API
+SPOTIFY_MAX_CONCURRENCY = int(os.getenv("SPOTIFY_MAX_CONCURRENCY", "10"))
+
+# Size and lifetime (in seconds) of the in-memory artist genre cache
+GENRE_CACHE_SIZE = int(os.getenv("GENRE_CACHE_SIZE", "10000"))
+GENRE_CACHE_TTL = float(os.getenv("GENRE_CACHE_TTL", "86400"))
+
+# Maximum size in MB of the in-memory cover image cache
+COVER_CACHE_SIZE_MB = int(os.getenv("COVER_CACHE_SIZE_MB", "64"))
+
+# Number of tracks of a playlist or album processed at the same time
+# and the maximum time in seconds spent on a single track
+TRACK_CONCURRENCY = int(os.getenv("TRACK_CONCURRENCY", os.cpu_count() or 4))
+TRACK_TIMEOUT = float(os.getenv("TRACK_TIMEOUT", "600"))
+
+# Jobs with at most this many tracks (single tracks, singles, EPs) go
+# ahead of larger ones, and the maximum number of tracks of one user
+# converted at the same time (0 for no limit)
+SMALL_JOB_TRACKS = int(os.getenv("SMALL_JOB_TRACKS", "1"))
+USER_MAX_TRACKS = int(os.getenv("USER_MAX_TRACKS", "0"))
+
+# Number of app processes serving the webhook (also read by uvicorn)
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+# Number of worker processes for downloading and converting tracks in
+# each app process and the number of tracks after which a worker
+# process is replaced
+WORKER_POOL_SIZE = int(
+    os.getenv(
+        "WORKER_POOL_SIZE", max(1, (os.cpu_count() or 4) // WEB_CONCURRENCY)
+    )
+)
+WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", "50"))
+
+# Parallel connections used to download all tracks of an app process at
+# the same time, and at most per track. Every worker process gets an
+# equal share of the total, so track and playlist parallelism share one
+# budget. 1 connection per track downloads each track sequentially.
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "32"))
+DOWNLOAD_CONNECTIONS_PER_TRACK = int(
+    os.getenv("DOWNLOAD_CONNECTIONS_PER_TRACK", "4")
+)
+
+# How tracks are tagged: "ffmpeg" converts and tags them in one ffmpeg
+# pass, "eyed3" tags the converted file afterwards (MP3 only)
+TAGGING_MODE = os.getenv("TAGGING_MODE", "ffmpeg").lower()
+assert TAGGING_MODE in (
+    "ffmpeg",
+    "eyed3",
+), "TAGGING_MODE must be one of: ffmpeg, eyed3"
+
+# Format of the sent tracks: "mp3" or "m4a" transcode the audio, "copy"
+# keeps YouTube's AAC stream in an M4A file without re-encoding.
+# AUDIO_BITRATE (e.g. "192k") applies when transcoding, empty for the
+# encoder's default.
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "mp3").lower()
+AUDIO_BITRATE = os.getenv("AUDIO_BITRATE", "")
+assert OUTPUT_FORMAT in (
+    "mp3",
+    "m4a",
+    "copy",
+), "OUTPUT_FORMAT must be one of: mp3, m4a, copy"
+
+# Playlists and albums with more than LARGE_JOB_TRACKS tracks are sent
+# in LARGE_JOB_OUTPUT_FORMAT instead (0 turns this off)
+LARGE_JOB_TRACKS = int(os.getenv("LARGE_JOB_TRACKS", "0"))
+LARGE_JOB_OUTPUT_FORMAT = os.getenv("LARGE_JOB_OUTPUT_FORMAT", "copy").lower()
+assert LARGE_JOB_OUTPUT_FORMAT in (
+    "mp3",
+    "m4a",
+    "copy",
+), "LARGE_JOB_OUTPUT_FORMAT must be one of: mp3, m4a, copy"
+
+# Where downloaded tracks are cached and where the bot keeps its state
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "media/cache")
+STATE_DB_PATH = os.getenv(
+    "STATE_DB_PATH", os.path.join(MEDIA_CACHE_DIR, "state.db")
+)
+# Maximum size in MB of the track cache (0 for no limit). The least
+# recently used tracks are evicted first.
+MEDIA_CACHE_MAX_SIZE_MB = int(os.getenv("MEDIA_CACHE_MAX_SIZE_MB", "10240"))
+
+# Age in seconds after which job directories left behind by a crash
+# are removed
+JOB_DIR_MAX_AGE = float(os.getenv("JOB_DIR_MAX_AGE", "86400"))
+
+# SQLite journal mode of the state database. WAL lets app processes on
+# one host read while another writes; use DELETE when the database is on
+# a network file system shared by several hosts
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+
+# How long in seconds received update IDs are remembered to drop
+# Telegram's redeliveries
+UPDATE_DEDUP_WINDOW = float(os.getenv("UPDATE_DEDUP_WINDOW", "86400"))
+
+# How long in seconds the tracks a user got from a playlist are
+# remembered, so a resent playlist only delivers the added tracks
+PLAYLIST_SYNC_TTL = float(os.getenv("PLAYLIST_SYNC_TTL", "7776000"))
+
+# Lifetime in seconds of cached YouTube search results, and of cached
+# searches that found nothing
+YOUTUBE_SEARCH_CACHE_TTL = float(
+    os.getenv("YOUTUBE_SEARCH_CACHE_TTL", str(30 * 24 * 3600))
+)
+YOUTUBE_SEARCH_NEGATIVE_TTL = float(
+    os.getenv("YOUTUBE_SEARCH_NEGATIVE_TTL", str(24 * 3600))
+)
+
+# Assemble playlist and album archives during the upload instead of
+# writing them to disk first
+ARCHIVE_STREAMING = os.getenv("ARCHIVE_STREAMING", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# Largest file the bot may upload in MB (0 picks the Bot API limit:
+# 50 MB, or 2000 MB with a local Bot API server) and the maximum size
+# of one part of a playlist or album archive in MB
+TELEGRAM_UPLOAD_LIMIT_MB = int(os.getenv("TELEGRAM_UPLOAD_LIMIT_MB", "0"))
+ARCHIVE_PART_SIZE_MB = int(os.getenv("ARCHIVE_PART_SIZE_MB", "200"))
+
+# Minimum time in seconds between two edits of a progress message
+PROGRESS_UPDATE_INTERVAL = float(os.getenv("PROGRESS_UPDATE_INTERVAL", "3"))
+
+# Outgoing Bot API calls per second across all chats and to a single
+# chat, and how often a call rejected by flood control is retried
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "5"))
+
+# Number of updates processed at the same time, attempts per update,
+# and how long in seconds finished jobs are kept for deduplication
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "32"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))
+# Maximum number of updates of one user processed at the same time
+# (0 for no limit)
+USER_MAX_JOBS = int(os.getenv("USER_MAX_JOBS", "2"))
+# Time in seconds after which a job of an app process that stopped
+# renewing it is handed to another process
+JOB_LEASE = float(os.getenv("JOB_LEASE", "60"))
@@ -0,0 +1,158 @@
+import logging
+import os
+import subprocess
+
+from config import AUDIO_BITRATE
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = "ffmpeg"
+
+# File extension of each output format
+OUTPUT_EXTENSIONS = {"mp3": ".mp3", "m4a": ".m4a", "copy": ".m4a"}
+# yt-dlp format selection of each output format. Remuxing needs an AAC
+# source, which YouTube offers as M4A for nearly every video.
+DOWNLOAD_FORMATS = {
+    "mp3": "bestaudio/best",
+    "m4a": "bestaudio/best",
+    "copy": "bestaudio[ext=m4a]/bestaudio/best",
+}
+# Sources whose audio stream can be copied into an M4A file
+_AAC_EXTENSIONS = {".m4a", ".mp4"}
+
+
+def get_encoding_profile(
+    output_format: str, bitrate: str = AUDIO_BITRATE
+) -> str:
+    """
+    Describe how tracks are encoded, so cached tracks and uploads made
+    with other settings are never reused.
+
+    Args:
+        output_format (str): One of "mp3", "m4a" or "copy".
+        bitrate (str): Audio bitrate when transcoding, e.g. "192k".
+
+    Returns:
+        str: The profile, e.g. "mp3" or "m4a@192k".
+    """
+    if not bitrate:
+        return output_format
+    return f"{output_format}@{bitrate.lower()}"
+
+
+def _get_track_number(track_info: dict) -> str | None:
+    track_number = str(track_info["track_number"])
+    total_tracks = str(track_info["total_tracks"])
+    if not track_number.isdigit():
+        return None
+    if total_tracks.isdigit():
+        return f"{track_number}/{total_tracks}"
+    return track_number
+
+
+def get_metadata_args(track_info: dict) -> list[str]:
+    """
+    Build the ffmpeg arguments that write the track's tags.
+
+    Args:
+        track_info (dict): A dictionary containing track information.
+
+    Returns:
+        list[str]: ffmpeg '-metadata' arguments.
+    """
+    tags = {
+        "title": track_info["title"],
+        "artist": track_info["artists"],
+        "album": track_info["album"],
+        "date": track_info["release_date"],
+        "genre": track_info["genres"],
+        "track": _get_track_number(track_info),
+    }
+    args = []
+    for key, value in tags.items():
+        if value:
+            args += ["-metadata", f"{key}={value}"]
+    return args
+
+
+def _get_audio_args(
+    source_path: str, output_format: str, bitrate: str
+) -> list[str]:
+    if output_format == "copy":
+        _, extension = os.path.splitext(source_path)
+        if extension.lower() in _AAC_EXTENSIONS:
+            return ["-c:a", "copy"]
+        logger.info(f"Can't remux {source_path}, converting it to AAC")
+        output_format = "m4a"
+
+    if output_format == "mp3":
+        args = ["-c:a", "libmp3lame", "-id3v2_version", "3"]
+    else:
+        args = ["-c:a", "aac"]
+    if bitrate:
+        args += ["-b:a", bitrate]
+    return args
+
+
+def encode_track(
+    source_path: str,
+    output_path: str,
+    track_info: dict,
+    cover_data: bytes | None = None,
+    output_format: str = "mp3",
+    bitrate: str = AUDIO_BITRATE,
+) -> str:
+    """
+    Convert a downloaded audio file to the output format, writing the
+    tags and the cover image in the same ffmpeg pass.
+
+    With the "copy" format, AAC audio is remuxed into an M4A file
+    without re-encoding. Other sources are converted to AAC.
+    The cover is passed to ffmpeg through a pipe, so it never touches
+    the disk.
+
+    Args:
+        source_path (str): The downloaded audio file.
+        output_path (str): Where the tagged file is written.
+        track_info (dict): A dictionary containing track information.
+        cover_data (bytes | None): The JPEG cover image to embed.
+        output_format (str): One of "mp3", "m4a" or "copy".
+        bitrate (str): Audio bitrate when transcoding, e.g. "192k",
+        or empty for the encoder's default.
+
+    Returns:
+        str: The path to the tagged file.
+
+    Raises:
+        subprocess.CalledProcessError: If ffmpeg fails.
+    """
+    command = [FFMPEG, "-hide_banner", "-loglevel", "error", "-y"]
+    command += ["-i", source_path]
+    if cover_data:
+        command += ["-f", "jpeg_pipe", "-i", "pipe:0"]
+    command += ["-map", "0:a:0"]
+    if cover_data:
+        command += [
+            "-map",
+            "1:v:0",
+            "-c:v",
+            "copy",
+            "-disposition:v",
+            "attached_pic",
+            "-metadata:s:v",
+            "title=Album cover",
+            "-metadata:s:v",
+            "comment=Cover (front)",
+        ]
+    command += _get_audio_args(source_path, output_format, bitrate)
+    command += get_metadata_args(track_info)
+    command += [output_path]
+
+    try:
+        subprocess.run(
+            command, input=cover_data, capture_output=True, check=True
+        )
+    except subprocess.CalledProcessError as e:
+        logger.error(f"ffmpeg failed: {e.stderr.decode(errors='replace')}")
+        raise
+    return output_path
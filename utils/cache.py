@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+class TTLCache:
+    """
+    A bounded in-memory cache whose entries expire after a fixed time.
+
+    When the cache is full, the least recently used entry is evicted.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        """
+        Args:
+            maxsize (int): Maximum number of entries kept in the cache.
+            ttl (float): Lifetime of an entry in seconds.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """
+        Return the cached value for key, or default if it is missing
+        or expired.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any) -> None:
+        """
+        Store value under key, evicting the least recently used entry
+        if the cache is full.
+        """
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class BytesLRUCache:
+    """
+    An in-memory cache of binary blobs bounded by their total size.
+
+    When adding a blob exceeds the size bound, the least recently used
+    blobs are evicted.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        """
+        Args:
+            max_bytes (int): Maximum total size of the cached blobs.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data: OrderedDict[Any, bytes] = OrderedDict()
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Any) -> bytes | None:
+        """
+        Return the blob cached under key, or None if it is missing.
+        """
+        data = self._data.get(key)
+        if data is not None:
+            self._data.move_to_end(key)
+        return data
+
+    def set(self, key: Any, data: bytes) -> None:
+        """
+        Store data under key. Blobs larger than the whole cache
+        are not stored.
+        """
+        if key in self._data:
+            self.size -= len(self._data.pop(key))
+        if len(data) > self.max_bytes:
+            return
+        self._data[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.size -= len(evicted)
+
+
+_MISSING = object()
@@ -0,0 +1,182 @@
+import asyncio
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Hashable
+
+
+@dataclass(eq=False)
+class _Request:
+    user_id: Hashable
+    cost: float
+    future: asyncio.Future = field(repr=False)
+
+
+class FairScheduler:
+    """
+    Share a fixed number of slots between users with deficit round-robin.
+
+    Every user waiting for a slot gets a turn in rotation, so a user with
+    a thousand queued tracks gets no more slots than a user with one.
+    Requests marked as priority (tracks of small jobs, such as a single
+    track) skip the rotation and get the next free slot. A waiting
+    request given a key can be promoted to priority later.
+    """
+
+    def __init__(
+        self, slots: int, user_limit: int = 0, quantum: float = 1.0
+    ) -> None:
+        """
+        Args:
+            slots (int): Number of slots handed out at the same time.
+            user_limit (int): Maximum number of slots a single user holds
+            at the same time, 0 for no limit.
+            quantum (float): Cost a user may spend per turn.
+        """
+        self.slots = max(1, slots)
+        self.user_limit = user_limit
+        self.quantum = quantum
+        self._used = 0
+        self._running: dict[Hashable, int] = defaultdict(int)
+        self._priority: deque[_Request] = deque()
+        self._queues: dict[Hashable, deque[_Request]] = {}
+        self._deficits: dict[Hashable, float] = {}
+        # Users with queued requests in round-robin order
+        self._active: deque[Hashable] = deque()
+        # Waiting requests that were given a key
+        self._keys: dict[Hashable, _Request] = {}
+
+    @property
+    def waiting(self) -> int:
+        """
+        Number of requests waiting for a slot.
+        """
+        return len(self._priority) + sum(map(len, self._queues.values()))
+
+    def _is_capped(self, user_id: Hashable) -> bool:
+        return 0 < self.user_limit <= self._running.get(user_id, 0)
+
+    def _pop_priority(self) -> _Request | None:
+        for request in self._priority:
+            if not self._is_capped(request.user_id):
+                self._priority.remove(request)
+                return request
+        return None
+
+    def _pop_next(self) -> _Request | None:
+        if not any(not self._is_capped(user) for user in self._active):
+            return None
+        while True:
+            user_id = self._active[0]
+            queue = self._queues[user_id]
+            if self._is_capped(user_id):
+                self._active.rotate(-1)
+                continue
+            if self._deficits[user_id] < queue[0].cost:
+                # The user's turn is over, top up for the next round
+                self._deficits[user_id] += self.quantum
+                self._active.rotate(-1)
+                continue
+            request = queue.popleft()
+            self._deficits[user_id] -= request.cost
+            if not queue:
+                self._remove_user(user_id)
+            return request
+
+    def _remove_user(self, user_id: Hashable) -> None:
+        del self._queues[user_id]
+        del self._deficits[user_id]
+        self._active.remove(user_id)
+
+    def _dispatch(self) -> None:
+        while self._used < self.slots:
+            request = self._pop_priority() or self._pop_next()
+            if request is None:
+                return
+            self._used += 1
+            self._running[request.user_id] += 1
+            request.future.set_result(None)
+
+    def _release(self, user_id: Hashable) -> None:
+        self._used -= 1
+        self._running[user_id] -= 1
+        if not self._running[user_id]:
+            del self._running[user_id]
+        self._dispatch()
+
+    def promote(self, key: Hashable) -> None:
+        """
+        Move a waiting request ahead of the rotation, as if it had been
+        made with priority.
+
+        Args:
+            key (Hashable): The key the request was made with. Unknown
+            keys and requests holding a slot are ignored.
+        """
+        request = self._keys.get(key)
+        if request is None or request in self._priority:
+            return
+        self._discard(request)
+        self._priority.append(request)
+        self._dispatch()
+
+    def _discard(self, request: _Request) -> None:
+        if request in self._priority:
+            self._priority.remove(request)
+            return
+        queue = self._queues.get(request.user_id)
+        if queue is not None and request in queue:
+            queue.remove(request)
+            if not queue:
+                self._remove_user(request.user_id)
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        user_id: Hashable,
+        cost: float = 1.0,
+        priority: bool = False,
+        key: Hashable = None,
+    ) -> AsyncIterator[None]:
+        """
+        Wait for a slot and hold it until the block exits.
+
+        Args:
+            user_id (Hashable): The user the work is done for.
+            cost (float): Relative cost of the work.
+            priority (bool): Serve the request before the rotation.
+            key (Hashable): Identifies the request while it waits, so it
+            can be passed to promote.
+        """
+        request = _Request(
+            user_id, cost, asyncio.get_running_loop().create_future()
+        )
+        if priority:
+            self._priority.append(request)
+        else:
+            if user_id not in self._queues:
+                self._queues[user_id] = deque()
+                self._deficits[user_id] = 0.0
+                self._active.append(user_id)
+            self._queues[user_id].append(request)
+        if key is not None:
+            self._keys[key] = request
+        self._dispatch()
+
+        try:
+            await request.future
+        except asyncio.CancelledError:
+            if request.future.done() and not request.future.cancelled():
+                # The slot was handed out just before the cancellation
+                self._release(user_id)
+            else:
+                self._discard(request)
+            raise
+        finally:
+            if key is not None and self._keys.get(key) is request:
+                del self._keys[key]
+
+        try:
+            yield
+        finally:
+            self._release(user_id)
@@ -0,0 +1,118 @@
+import hashlib
+import sqlite3
+import time
+from contextlib import closing
+
+from config import OUTPUT_FORMAT
+from utils.audio_utils import get_encoding_profile
+from utils.storage import connect
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS telegram_files (
+    cache_key TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    created_at REAL NOT NULL
+)
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    connection = connect()
+    connection.execute(_SCHEMA)
+    return connection
+
+
+def _get_format_suffix(output_format: str) -> str:
+    # MP3 uploads at the default bitrate keep the keys they were saved
+    # under before other formats existed
+    profile = get_encoding_profile(output_format)
+    return "" if profile == "mp3" else f":{profile}"
+
+
+def get_track_key(track_id: str, output_format: str = OUTPUT_FORMAT) -> str:
+    """
+    Build the cache key of a single track.
+
+    Args:
+        track_id (str): Spotify track ID.
+        output_format (str): Output format of the track.
+
+    Returns:
+        str: Cache key.
+    """
+    return f"track:{track_id}{_get_format_suffix(output_format)}"
+
+
+def get_archive_key(
+    kind: str,
+    source_id: str,
+    track_ids: list,
+    output_format: str = OUTPUT_FORMAT,
+) -> str:
+    """
+    Build the cache key of a playlist or album archive.
+
+    The key covers the exact set of tracks in the archive, so an archive
+    with different content never reuses an old upload.
+
+    Args:
+        kind (str): Archive kind, e.g. 'playlist' or 'album'.
+        source_id (str): Spotify ID of the playlist or album.
+        track_ids (list): Spotify IDs of the tracks in the archive.
+        output_format (str): Output format of the tracks.
+
+    Returns:
+        str: Cache key.
+    """
+    content = ",".join(sorted(track_ids)).encode("utf-8")
+    digest = hashlib.sha256(content).hexdigest()
+    return f"{kind}:{source_id}:{digest}{_get_format_suffix(output_format)}"
+
+
+def get_file_id(cache_key: str) -> str | None:
+    """
+    Look up the Telegram file_id of a previously uploaded file.
+
+    Args:
+        cache_key (str): Cache key of the file.
+
+    Returns:
+        str | None: The file_id, or None if the file was never uploaded.
+    """
+    with closing(_connect()) as connection:
+        row = connection.execute(
+            "SELECT file_id FROM telegram_files WHERE cache_key = ?",
+            (cache_key,),
+        ).fetchone()
+    return row["file_id"] if row else None
+
+
+def save_file_id(cache_key: str, file_id: str, file_type: str) -> None:
+    """
+    Remember the Telegram file_id of an uploaded file.
+
+    Args:
+        cache_key (str): Cache key of the file.
+        file_id (str): The file_id returned by Telegram.
+        file_type (str): The type of the file, 'audio' or 'document'.
+    """
+    with closing(_connect()) as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO telegram_files "
+            "(cache_key, file_id, file_type, created_at) VALUES (?, ?, ?, ?)",
+            (cache_key, file_id, file_type, time.time()),
+        )
+
+
+def delete_file_id(cache_key: str) -> None:
+    """
+    Forget the file_id of a file, e.g. after Telegram rejected it.
+
+    Args:
+        cache_key (str): Cache key of the file.
+    """
+    with closing(_connect()) as connection:
+        connection.execute(
+            "DELETE FROM telegram_files WHERE cache_key = ?", (cache_key,)
+        )
@@ -1,63 +1,458 @@
+import asyncio
+import io
 import logging
 import os
+import weakref
 import zipfile
+from typing import AsyncGenerator, Awaitable, Callable, Iterator
 
 from aiogram import types
-from aiogram.exceptions import TelegramAPIError
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+
+from utils.file_id_cache import delete_file_id, get_file_id, save_file_id
 
 logger = logging.getLogger(__name__)
 
+# Held while a file is uploaded under a cache key, so concurrent sends of
+# the same content wait for the upload and reuse its file_id
+_upload_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = (
+    weakref.WeakValueDictionary()
+)
+
+
+def _get_unique_name(name: str, used_names: set) -> str:
+    base, extension = os.path.splitext(name)
+    unique_name = name
+    counter = 2
+    while unique_name in used_names:
+        unique_name = f"{base} ({counter}){extension}"
+        counter += 1
+    used_names.add(unique_name)
+    return unique_name
+
+
+class ZipArchive:
+    """
+    A ZIP archive written to disk one file at a time.
+
+    Files are stored without recompression, and all disk work runs
+    in a thread, off the event loop.
+    """
+
+    def __init__(self, zip_path: str, folder: str) -> None:
+        """
+        Args:
+            zip_path (str): The path where the ZIP file will be created.
+            folder (str): Name of the folder inside the archive.
+        """
+        self.zip_path = zip_path
+        self.folder = folder
+        self.names: set[str] = set()
+        self._zip: zipfile.ZipFile | None = None
+        self._lock = asyncio.Lock()
+
+    def _add(self, file_path: str, name: str | None) -> None:
+        if self._zip is None:
+            os.makedirs(os.path.dirname(self.zip_path) or ".", exist_ok=True)
+            self._zip = zipfile.ZipFile(self.zip_path, "w", zipfile.ZIP_STORED)
+        name = _get_unique_name(
+            name or os.path.basename(file_path), self.names
+        )
+        self._zip.write(file_path, os.path.join(self.folder, name))
+
+    async def add(self, file_path: str, name: str | None = None) -> None:
+        """
+        Append a file to the archive.
+
+        Args:
+            file_path (str): The path to the file.
+            name (str | None): Name of the file inside the archive,
+            the name of file_path by default.
+        """
+        async with self._lock:
+            await asyncio.to_thread(self._add, file_path, name)
+
+    async def close(self) -> None:
+        """
+        Finish writing the archive.
+        """
+        async with self._lock:
+            if self._zip is not None:
+                await asyncio.to_thread(self._zip.close)
+                self._zip = None
+
+
+class _StreamWriter(io.RawIOBase):
+    """
+    An unseekable sink that collects what zipfile writes into it.
+    """
+
+    def __init__(self) -> None:
+        self.chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:  # type: ignore[override]
+        self.chunks.append(bytes(data))
+        return len(data)
 
-def create_zip_file(directory: str, zip_path: str) -> None:
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _iter_zip_chunks(
+    file_paths: list, folder: str, chunk_size: int, names: list | None
+) -> Iterator[bytes]:
+    writer = _StreamWriter()
+    used_names: set[str] = set()
+    with zipfile.ZipFile(writer, "w", zipfile.ZIP_STORED) as zipf:
+        for index, file_path in enumerate(file_paths):
+            name = names[index] if names else os.path.basename(file_path)
+            name = _get_unique_name(name, used_names)
+            zinfo = zipfile.ZipInfo.from_file(
+                file_path, os.path.join(folder, name)
+            )
+            with open(file_path, "rb") as src, zipf.open(zinfo, "w") as dest:
+                while chunk := src.read(chunk_size):
+                    dest.write(chunk)
+                    yield writer.drain()
+    yield writer.drain()
+
+
+class ZipStreamInputFile(types.InputFile):
+    """
+    A ZIP archive that is assembled while it is being uploaded,
+    without writing an intermediate file to disk.
     """
-    Create a ZIP file containing all .mp3 files in a specified directory.
+
+    def __init__(
+        self,
+        file_paths: list,
+        folder: str,
+        filename: str,
+        names: list | None = None,
+    ) -> None:
+        """
+        Args:
+            file_paths (list): Paths to the files to put in the archive.
+            folder (str): Name of the folder inside the archive.
+            filename (str): File name of the archive shown to the user.
+            names (list | None): Names of the files inside the archive,
+            the names of file_paths by default.
+        """
+        super().__init__(filename=filename)
+        self.file_paths = file_paths
+        self.folder = folder
+        self.names = names
+
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        chunks = _iter_zip_chunks(
+            self.file_paths, self.folder, self.chunk_size, self.names
+        )
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                yield chunk
+
+
+# Fixed part of the local file header and the central directory record
+# of an entry, whose name is stored in both
+ZIP_ENTRY_HEADERS = 30 + 46
+# Room for a data descriptor, ZIP64 extra fields and the " (n)" suffix
+# given to duplicate names
+ZIP_ENTRY_EXTRA = 128
+# Upper bound of the end of central directory records
+ZIP_ARCHIVE_OVERHEAD = 1024
+
+
+def get_zip_entry_overhead(arcname: str) -> int:
+    """
+    Get an upper bound of the bytes a ZIP archive adds for an entry,
+    besides its content.
 
     Args:
-        directory (str): The directory containing .mp3 files to be zipped.
-        zip_path (str): The path where the ZIP file will be created.
-    """
-    with zipfile.ZipFile(zip_path, "w") as zipf:
-        for file in os.listdir(directory):
-            if file.endswith(".mp3"):
-                zipf.write(
-                    os.path.join(directory, file),
-                    os.path.join(os.path.basename(directory), file),
+        arcname (str): Path of the entry inside the archive.
+
+    Returns:
+        int: Overhead in bytes.
+    """
+    name_size = len(arcname.encode("utf-8"))
+    return ZIP_ENTRY_HEADERS + 2 * name_size + ZIP_ENTRY_EXTRA
+
+
+VolumeCallback = Callable[[types.InputFile, list, int], Awaitable[bool]]
+CachedVolumeCallback = Callable[[list, int], Awaitable[bool]]
+
+
+class _Volume:
+    def __init__(self, number: int) -> None:
+        self.number = number
+        self.file_paths: list[str] = []
+        self.names: list[str] = []
+        self.keys: list[str] = []
+        self.size = ZIP_ARCHIVE_OVERHEAD
+
+
+class ArchiveVolumes:
+    """
+    Splits the tracks of a job into numbered, size-capped ZIP archives
+    and hands each one over as soon as it is full, instead of sending
+    a single archive at the end.
+
+    A part is only written once it is full, so a part that was uploaded
+    before can be resent without writing it again. Each part is deleted
+    after it was delivered, which keeps the disk space used by a job
+    bounded.
+    """
+
+    def __init__(
+        self,
+        archive_dir: str,
+        title: str,
+        max_size: int,
+        on_volume: VolumeCallback,
+        streaming: bool = False,
+        send_cached: CachedVolumeCallback | None = None,
+    ) -> None:
+        """
+        Args:
+            archive_dir (str): Directory where the parts are written.
+            title (str): Title of the job, used for the archive names.
+            max_size (int): Maximum size of a part in bytes.
+            on_volume (VolumeCallback): Awaited with the finished part,
+            the keys of the files in it and the part number. Returns
+            whether the part reached the user.
+            streaming (bool): Assemble each part during the upload
+            instead of writing it to disk.
+            send_cached (CachedVolumeCallback | None): Awaited with the
+            keys of the files in a finished part and the part number
+            before the part is written. Returns whether an earlier
+            upload of the same part was sent instead.
+        """
+        self.archive_dir = archive_dir
+        self.title = title
+        self.max_size = max_size
+        self.on_volume = on_volume
+        self.streaming = streaming
+        self.send_cached = send_cached
+        self.volumes_sent = 0
+        self.volumes_failed = 0
+        # Keys of the files in the parts that reached the user
+        self.delivered_keys: list[str] = []
+        self._volume: _Volume | None = None
+        self._count = 0
+        self._lock = asyncio.Lock()
+        self._send_lock = asyncio.Lock()
+
+    def _get_filename(self, volume: _Volume, is_last: bool) -> str:
+        if is_last and volume.number == 1:
+            return f"{self.title}.zip"
+        return f"{self.title} (part {volume.number}).zip"
+
+    async def add(
+        self, file_path: str, key: str, name: str | None = None
+    ) -> None:
+        """
+        Add a file to the current part. If the file does not fit,
+        the current part is delivered first.
+
+        Args:
+            file_path (str): The path to the file.
+            key (str): Identifies the file content, e.g. a track ID.
+            name (str | None): Name of the file inside the archive,
+            the name of file_path by default.
+        """
+        name = name or os.path.basename(file_path)
+        size = os.path.getsize(file_path) + get_zip_entry_overhead(
+            os.path.join(self.title, name)
+        )
+        finished = None
+        async with self._lock:
+            volume = self._volume
+            if volume and volume.file_paths:
+                if volume.size + size > self.max_size:
+                    finished = volume
+                    volume = None
+
+            if volume is None:
+                self._count += 1
+                volume = self._volume = _Volume(self._count)
+
+            volume.file_paths.append(file_path)
+            volume.names.append(name)
+            volume.keys.append(key)
+            volume.size += size
+
+        if finished is not None:
+            await self._deliver(finished, is_last=False)
+
+    async def close(self) -> None:
+        """
+        Deliver the last, partially filled part.
+        """
+        async with self._lock:
+            volume, self._volume = self._volume, None
+        if volume is not None and volume.file_paths:
+            await self._deliver(volume, is_last=True)
+
+    async def _deliver(self, volume: _Volume, is_last: bool) -> None:
+        # Parts are handed over in order, one at a time
+        async with self._send_lock:
+            if self.send_cached is not None and await self.send_cached(
+                volume.keys, volume.number
+            ):
+                self.volumes_sent += 1
+                self.delivered_keys.extend(volume.keys)
+                return
+
+            filename = self._get_filename(volume, is_last)
+            file: types.InputFile
+            archive = None
+            if self.streaming:
+                file = ZipStreamInputFile(
+                    volume.file_paths, self.title, filename, volume.names
+                )
+            else:
+                archive = ZipArchive(
+                    os.path.join(
+                        self.archive_dir,
+                        f"{self.title} (part {volume.number}).zip",
+                    ),
+                    self.title,
                 )
+                for file_path, name in zip(volume.file_paths, volume.names):
+                    await archive.add(file_path, name)
+                await archive.close()
+                file = types.FSInputFile(archive.zip_path, filename)
 
+            try:
+                if await self.on_volume(file, volume.keys, volume.number):
+                    self.volumes_sent += 1
+                    self.delivered_keys.extend(volume.keys)
+                else:
+                    self.volumes_failed += 1
+            finally:
+                if archive is not None:
+                    await asyncio.to_thread(os.remove, archive.zip_path)
 
-async def send_file_to_user(
-    message: types.Message, file_path: str, file_type: str
+
+async def _answer_file(
+    message: types.Message, file: str | types.InputFile, file_type: str
+) -> types.Message:
+    if file_type == "audio":
+        return await message.answer_audio(file)
+    elif file_type == "document":
+        return await message.answer_document(file)
+    raise ValueError("Unsupported file type. Use 'audio' or 'document'.")
+
+
+async def send_cached_file(
+    message: types.Message, cache_key: str, file_type: str
+) -> bool:
+    """
+    Send a file that was uploaded before, using its Telegram file_id.
+
+    A file_id that Telegram no longer accepts is forgotten.
+
+    Args:
+        message (types.Message): The Telegram message object.
+        cache_key (str): Cache key the file_id was saved under.
+        file_type (str): The type of the file, either 'audio' or 'document'.
+
+    Returns:
+        bool: True if the file was sent, False if there is no usable
+        file_id and the file has to be uploaded.
+    """
+    file_id = await asyncio.to_thread(get_file_id, cache_key)
+    if file_id is None:
+        return False
+
+    try:
+        await _answer_file(message, file_id, file_type)
+        logger.info(f"Sent cached file for {cache_key}")
+        return True
+    except TelegramBadRequest as e:
+        logger.warning(f"Stale file_id for {cache_key}: {e}")
+        await asyncio.to_thread(delete_file_id, cache_key)
+    return False
+
+
+async def _upload_file(
+    message: types.Message,
+    file_path: str | types.InputFile,
+    file_type: str,
+    cache_key: str | None = None,
 ) -> None:
+    if isinstance(file_path, types.InputFile):
+        file = file_path
+    else:
+        file = types.FSInputFile(file_path)
+    sent_message = await _answer_file(message, file, file_type)
+
+    # Telegram may store audio it can't parse as a document
+    media = sent_message.audio or sent_message.document
+    if cache_key and media:
+        await asyncio.to_thread(
+            save_file_id, cache_key, media.file_id, file_type
+        )
+
+
+async def send_file_to_user(
+    message: types.Message,
+    file_path: str | types.InputFile,
+    file_type: str,
+    cache_key: str | None = None,
+) -> bool:
     """
     Send a file to the user via Telegram.
 
+    If a cache_key is given, a previous upload of the same file is resent
+    by its file_id, and the file_id of a new upload is remembered.
+    Sends of a file that is being uploaded under the same cache_key wait
+    for that upload and resend it.
+
     Args:
         message (types.Message): The Telegram message object.
-        file_path (str): The path to the file to be sent.
+        file_path (str | types.InputFile): The path to the file to be sent,
+        or an InputFile that produces its content.
         file_type (str): The type of the file, either 'audio' or 'document'.
+        cache_key (str | None): Key identifying the file content,
+        e.g. from get_track_key or get_archive_key.
+
+    Returns:
+        bool: True if the file was sent, False if sending failed and
+        the user was told so.
 
     Raises:
         ValueError: If the file_type is not 'audio' or 'document'.
     """
     try:
-        if file_type == "audio":
-            file = types.FSInputFile(file_path)
-            await message.answer_audio(file)
-        elif file_type == "document":
-            file = types.FSInputFile(file_path)
-            await message.answer_document(file)
-        else:
-            raise ValueError(
-                "Unsupported file type. Use 'audio' or 'document'."
-            )
+        if not cache_key:
+            await _upload_file(message, file_path, file_type)
+            return True
+
+        upload_lock = _upload_locks.get(cache_key)
+        if upload_lock is None:
+            upload_lock = _upload_locks[cache_key] = asyncio.Lock()
+        async with upload_lock:
+            if await send_cached_file(message, cache_key, file_type):
+                return True
+            await _upload_file(message, file_path, file_type, cache_key)
+        return True
     # Handling error if file is too big
     except TelegramAPIError as e:
         logger.error(f"Telegram API error on attempt: {e}")
         await message.reply(
             "An unexpected error occurred. Please try again later."
         )
-    except BaseException as e:
+    except Exception as e:
         logger.error(f"Unexpected error on attempt: {e}")
         await message.reply(
             f"An unexpected error occurred. Please try again later."
         )
+    return False
@@ -0,0 +1,46 @@
+import logging
+
+import aiohttp
+
+from config import HTTP_KEEPALIVE_TIMEOUT, HTTP_MAX_CONNECTIONS, HTTP_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# One pooled session per process, created lazily inside the running loop
+_session: aiohttp.ClientSession | None = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Return the process-wide aiohttp session, creating it on first use.
+
+    The session keeps connections alive between requests, so repeated
+    calls to the same host reuse an already established TLS connection.
+
+    Returns:
+        aiohttp.ClientSession: The shared client session.
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_MAX_CONNECTIONS,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+        )
+        logger.info("Created shared HTTP session")
+    return _session
+
+
+async def close_session() -> None:
+    """
+    Close the process-wide aiohttp session if it was created.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("Shared HTTP session closed")
+    _session = None
@@ -0,0 +1,395 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from contextlib import closing
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from config import JOB_LEASE, JOB_MAX_ATTEMPTS, JOB_RETENTION, USER_MAX_JOBS
+from utils.shared_state import WORKER_ID
+from utils.storage import connect
+
+logger = logging.getLogger(__name__)
+
+# How often idle workers look for jobs enqueued by someone else
+POLL_INTERVAL = 1.0
+
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    lease_owner TEXT,
+    lease_expires_at REAL,
+    user_id INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+_DELIVERIES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_deliveries (
+    job_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (job_id, key)
+)
+"""
+_INDEX = "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)"
+_USER_INDEX = "CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, state)"
+# Columns added after the table was first created
+_ADDED_COLUMNS = {
+    "lease_owner": "TEXT",
+    "lease_expires_at": "REAL",
+    "user_id": "INTEGER",
+}
+
+
+@dataclass
+class Job:
+    """
+    A unit of work taken from the job queue.
+    """
+
+    id: int
+    idempotency_key: str
+    payload: dict
+    attempts: int
+
+
+# The job run by the current task and the tasks it started
+_current_job: ContextVar[Job | None] = ContextVar("current_job", default=None)
+
+
+def _connect() -> sqlite3.Connection:
+    connection = connect()
+    connection.execute(_SCHEMA)
+    connection.execute(_DELIVERIES_SCHEMA)
+    connection.execute(_INDEX)
+    columns = {
+        row["name"] for row in connection.execute("PRAGMA table_info(jobs)")
+    }
+    for column, column_type in _ADDED_COLUMNS.items():
+        if column not in columns:
+            connection.execute(
+                f"ALTER TABLE jobs ADD COLUMN {column} {column_type}"
+            )
+    connection.execute(_USER_INDEX)
+    return connection
+
+
+def enqueue_job(
+    idempotency_key: str, payload: dict, user_id: int | None = None
+) -> bool:
+    """
+    Add a job to the queue unless a job with the same key exists.
+
+    Args:
+        idempotency_key (str): Identifies the job, e.g. 'update:<id>'.
+        payload (dict): JSON-serializable job data.
+        user_id (int | None): The user the job is done for, used to
+        share the job workers fairly between users.
+
+    Returns:
+        bool: True if the job was added, False if it is a duplicate.
+    """
+    now = time.time()
+    with closing(_connect()) as connection:
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO jobs "
+            "(idempotency_key, payload, state, user_id, created_at, "
+            "updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                idempotency_key,
+                json.dumps(payload),
+                STATE_QUEUED,
+                user_id,
+                now,
+                now,
+            ),
+        )
+    return cursor.rowcount == 1
+
+
+def claim_job(owner: str = WORKER_ID) -> Job | None:
+    """
+    Take the next queued job and lease it to owner.
+
+    Jobs of users with the fewest running jobs go first, oldest first
+    among them, and users already running USER_MAX_JOBS jobs wait.
+    Jobs whose lease expired, because the worker running them crashed
+    or was redeployed, are queued again first, so any worker can
+    resume them. A claimed job with more attempts than JOB_MAX_ATTEMPTS
+    has to be given up with fail_job instead of being run.
+
+    Args:
+        owner (str): Identifies the worker claiming the job.
+
+    Returns:
+        Job | None: The claimed job, or None if the queue is empty.
+    """
+    now = time.time()
+    with closing(_connect()) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "UPDATE jobs SET state = ?, lease_owner = NULL, "
+                "updated_at = ? WHERE state = ? AND lease_expires_at < ?",
+                (STATE_QUEUED, now, STATE_RUNNING, now),
+            )
+            row = connection.execute(
+                "SELECT id, idempotency_key, payload, attempts, "
+                "(SELECT COUNT(*) FROM jobs AS running "
+                "WHERE running.state = ? AND running.user_id = queued.user_id"
+                ") AS user_jobs "
+                "FROM jobs AS queued WHERE state = ? "
+                "AND (? = 0 OR user_jobs < ?) "
+                "ORDER BY user_jobs, id LIMIT 1",
+                (STATE_RUNNING, STATE_QUEUED, USER_MAX_JOBS, USER_MAX_JOBS),
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET state = ?, attempts = attempts + 1, "
+                    "lease_owner = ?, lease_expires_at = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (STATE_RUNNING, owner, now + JOB_LEASE, now, row["id"]),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    if row is None:
+        return None
+    return Job(
+        id=row["id"],
+        idempotency_key=row["idempotency_key"],
+        payload=json.loads(row["payload"]),
+        attempts=row["attempts"] + 1,
+    )
+
+
+def renew_lease(job: Job, owner: str = WORKER_ID) -> bool:
+    """
+    Extend the lease of a running job.
+
+    Args:
+        job (Job): The running job.
+        owner (str): Identifies the worker running the job.
+
+    Returns:
+        bool: False if the job is no longer leased to owner.
+    """
+    with closing(_connect()) as connection:
+        cursor = connection.execute(
+            "UPDATE jobs SET lease_expires_at = ? "
+            "WHERE id = ? AND state = ? AND lease_owner = ?",
+            (time.time() + JOB_LEASE, job.id, STATE_RUNNING, owner),
+        )
+    return cursor.rowcount == 1
+
+
+def complete_job(job: Job, owner: str = WORKER_ID) -> None:
+    """
+    Mark a job as done.
+
+    Args:
+        job (Job): The finished job.
+        owner (str): Identifies the worker that ran the job.
+    """
+    with closing(_connect()) as connection:
+        connection.execute(
+            "UPDATE jobs SET state = ?, lease_owner = NULL, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ?",
+            (STATE_DONE, time.time(), job.id, owner),
+        )
+
+
+def fail_job(job: Job, error: str, owner: str = WORKER_ID) -> bool:
+    """
+    Record a failed attempt. The job is queued again until it has
+    used up its attempts.
+
+    Args:
+        job (Job): The failed job.
+        error (str): Description of the failure.
+        owner (str): Identifies the worker that ran the job.
+
+    Returns:
+        bool: True if the job will be retried, False if it failed for
+        good.
+    """
+    will_retry = job.attempts < JOB_MAX_ATTEMPTS
+    state = STATE_QUEUED if will_retry else STATE_FAILED
+    with closing(_connect()) as connection:
+        connection.execute(
+            "UPDATE jobs SET state = ?, last_error = ?, lease_owner = NULL, "
+            "updated_at = ? WHERE id = ? AND lease_owner = ?",
+            (state, error, time.time(), job.id, owner),
+        )
+    return will_retry
+
+
+def _get_deliveries(job: Job) -> set[str]:
+    with closing(_connect()) as connection:
+        rows = connection.execute(
+            "SELECT key FROM job_deliveries WHERE job_id = ?", (job.id,)
+        ).fetchall()
+    return {row["key"] for row in rows}
+
+
+def _add_deliveries(job: Job, keys: list[str]) -> None:
+    with closing(_connect()) as connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO job_deliveries (job_id, key) "
+            "VALUES (?, ?)",
+            [(job.id, key) for key in keys],
+        )
+
+
+async def get_job_deliveries() -> set[str]:
+    """
+    Get what earlier attempts of the running job delivered to the user,
+    so a resumed job can skip it.
+
+    Returns:
+        set[str]: Keys recorded with record_job_deliveries, empty
+        outside of a job.
+    """
+    job = _current_job.get()
+    if job is None:
+        return set()
+    return await asyncio.to_thread(_get_deliveries, job)
+
+
+async def record_job_deliveries(keys: list[str]) -> None:
+    """
+    Record that the running job delivered something to the user, such
+    as a file or the tracks in an archive. Does nothing outside of a job.
+
+    Args:
+        keys (list[str]): Identify what was delivered, e.g. track IDs.
+    """
+    job = _current_job.get()
+    if job is not None and keys:
+        await asyncio.to_thread(_add_deliveries, job, keys)
+
+
+def prune_jobs() -> int:
+    """
+    Remove finished jobs older than the retention period.
+
+    Returns:
+        int: Number of jobs removed.
+    """
+    with closing(_connect()) as connection:
+        cursor = connection.execute(
+            "DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?",
+            (STATE_DONE, STATE_FAILED, time.time() - JOB_RETENTION),
+        )
+        connection.execute(
+            "DELETE FROM job_deliveries "
+            "WHERE job_id NOT IN (SELECT id FROM jobs)"
+        )
+    return cursor.rowcount
+
+
+async def _keep_lease(job: Job, handler: asyncio.Task) -> None:
+    while True:
+        await asyncio.sleep(JOB_LEASE / 3)
+        try:
+            is_renewed = await asyncio.to_thread(renew_lease, job)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to renew the lease of a job: {e}")
+            continue
+        if not is_renewed:
+            # Another worker may run the job now, this one must stop
+            logger.warning(f"Lost the lease of job {job.idempotency_key}")
+            handler.cancel()
+            return
+
+
+async def _record_failure(
+    job: Job,
+    error: str,
+    on_failed: Callable[[dict], Awaitable[None]] | None,
+) -> None:
+    if await asyncio.to_thread(fail_job, job, error):
+        return
+    logger.error(f"Job {job.idempotency_key} failed for good: {error}")
+    if on_failed is None:
+        return
+    try:
+        await on_failed(job.payload)
+    except Exception as e:
+        logger.warning(f"Failed to report failed job: {e}")
+
+
+async def run_job_worker(
+    handle_job: Callable[[dict], Awaitable[None]],
+    wakeup: asyncio.Event,
+    on_failed: Callable[[dict], Awaitable[None]] | None = None,
+) -> None:
+    """
+    Execute queued jobs one after another, forever.
+
+    Failed and interrupted jobs are run again until they used up their
+    attempts. The handler should skip what it recorded as delivered
+    with record_job_deliveries in earlier attempts.
+
+    Args:
+        handle_job (Callable[[dict], Awaitable[None]]): Executes the
+        payload of a job. Raising marks the attempt as failed. It is
+        cancelled if the job's lease is lost.
+        wakeup (asyncio.Event): Set when a job was enqueued, so an idle
+        worker picks it up without waiting for the next poll.
+        on_failed (Callable[[dict], Awaitable[None]] | None): Awaited
+        with the payload of a job that failed for good.
+    """
+    while True:
+        job = await asyncio.to_thread(claim_job)
+        if job is None:
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        if job.attempts > JOB_MAX_ATTEMPTS:
+            # Interrupted on its last attempt
+            await _record_failure(job, "interrupted", on_failed)
+            continue
+
+        logger.info(
+            f"Running job {job.idempotency_key} (attempt {job.attempts})"
+        )
+        token = _current_job.set(job)
+        try:
+            handler = asyncio.create_task(handle_job(job.payload))
+        finally:
+            _current_job.reset(token)
+        lease_keeper = asyncio.create_task(_keep_lease(job, handler))
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not lease_keeper.done():
+                # The worker itself is being stopped
+                raise
+            logger.warning(f"Job {job.idempotency_key} was stopped")
+        except Exception as e:
+            logger.error(f"Job {job.idempotency_key} failed: {e}")
+            await _record_failure(job, str(e), on_failed)
+        else:
+            await asyncio.to_thread(complete_job, job)
+        finally:
+            lease_keeper.cancel()
@@ -0,0 +1,74 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from config import JOB_DIR_MAX_AGE
+from utils.track_cache import TEMP_DIR
+
+logger = logging.getLogger(__name__)
+
+# Directories holding the job directories of each kind of request
+JOB_ROOTS = ("media/tracks", "media/playlists", "media/albums")
+
+
+def create_job_dir(root: str, prefix: str = "") -> str:
+    """
+    Create a private directory for the files of one job.
+
+    Tracks are hard-linked into it from the track cache, so it takes no
+    extra space while the cached files exist. Every job gets its own
+    directory, so jobs for the same track or playlist never share files.
+
+    Args:
+        root (str): Directory the job directory is created in,
+        e.g. 'media/playlists'.
+        prefix (str): Start of the directory name, e.g. a Spotify ID.
+
+    Returns:
+        str: Path to the new directory.
+    """
+    os.makedirs(root, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f"{prefix}-" if prefix else "", dir=root)
+
+
+def remove_job_dir(job_dir: str) -> None:
+    """
+    Remove a job directory once the job is done. The tracks stay in the
+    track cache.
+
+    Args:
+        job_dir (str): Path returned by create_job_dir.
+    """
+    shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def prune_job_dirs(max_age: float = JOB_DIR_MAX_AGE) -> int:
+    """
+    Remove job and work directories left behind by crashed jobs.
+
+    Args:
+        max_age (float): Age in seconds after which a directory is
+        considered abandoned.
+
+    Returns:
+        int: Number of directories removed.
+    """
+    removed = 0
+    cutoff = time.time() - max_age
+    for root in (*JOB_ROOTS, TEMP_DIR):
+        if not os.path.isdir(root):
+            continue
+        for entry in os.scandir(root):
+            if entry.stat(follow_symlinks=False).st_mtime >= cutoff:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.remove(entry.path)
+            removed += 1
+
+    if removed:
+        logger.info(f"Removed {removed} abandoned job directories")
+    return removed
@@ -1,6 +1,13 @@
+import asyncio
 import logging
+import time
+from contextlib import nullcontext
 
 from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from config import PROGRESS_UPDATE_INTERVAL
+from utils.telegram_scheduler import PRIORITY_FINAL, outbound_priority
 
 logger = logging.getLogger(__name__)
 
@@ -10,6 +17,7 @@ async def update_progress(
     progress_text: str,
     chat_id: int | str | None,
     message_id: int | None,
+    final: bool = False,
 ) -> None:
     """
     Updates the progress message in a specified chat.
@@ -20,8 +28,144 @@ async def update_progress(
         chat_id (int | str | None): The ID of the chat where
         the message is located.
         message_id (int | None): The ID of the message to be updated.
+        final (bool): Whether this is the final status of the job,
+        which is sent ahead of pending progress updates.
     """
     logger.info(f"Updating progress: {progress_text}")
-    await bot.edit_message_text(
-        progress_text, chat_id=chat_id, message_id=message_id
-    )
+    priority = outbound_priority(PRIORITY_FINAL) if final else nullcontext()
+    with priority:
+        await bot.edit_message_text(
+            progress_text, chat_id=chat_id, message_id=message_id
+        )
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Format a duration for humans, e.g. '1h 05m' or '2m 30s'.
+
+    Args:
+        seconds (float): The duration in seconds.
+
+    Returns:
+        str: The formatted duration.
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+
+class ProgressReporter:
+    """
+    Keeps a progress message up to date without flooding Telegram.
+
+    Updates are coalesced: the message is edited in the background at
+    most once per interval, always with the latest text, and identical
+    texts are skipped. Callers never wait for an edit to finish.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        chat_id: int | str,
+        message_id: int,
+        interval: float = PROGRESS_UPDATE_INTERVAL,
+    ) -> None:
+        """
+        Args:
+            bot (Bot): An instance of the Bot to perform the updates.
+            chat_id (int | str): The ID of the chat with the message.
+            message_id (int): The ID of the message to be updated.
+            interval (float): Minimum time in seconds between two edits.
+        """
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self.started_at = time.monotonic()
+        self._pending_text: str | None = None
+        self._last_text: str | None = None
+        self._last_edit_at = 0.0
+        self._task: asyncio.Task | None = None
+
+    def update(self, text: str) -> None:
+        """
+        Schedule the message to show text.
+
+        Args:
+            text (str): The new progress text.
+        """
+        self._pending_text = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def set_progress(self, finished: int, total: int, text: str) -> None:
+        """
+        Schedule a progress update with the throughput and the estimated
+        time left appended.
+
+        Args:
+            finished (int): Number of finished items.
+            total (int): Total number of items.
+            text (str): Description of the latest finished item.
+        """
+        elapsed = time.monotonic() - self.started_at
+        if finished and elapsed > 0:
+            rate = finished / elapsed
+            eta = format_duration((total - finished) / rate)
+            text += f"\n{rate * 60:.1f} tracks/min, about {eta} left"
+        self.update(text)
+
+    async def finish(self, text: str) -> None:
+        """
+        Stop the background updates and show the final text right away.
+
+        Args:
+            text (str): The final progress text.
+        """
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._pending_text = None
+        while retry_after := await self._edit(text, final=True):
+            await asyncio.sleep(retry_after)
+
+    async def _run(self) -> None:
+        while self._pending_text is not None:
+            delay = self._last_edit_at + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            text, self._pending_text = self._pending_text, None
+            if await self._edit(text):  # type: ignore
+                # Flood wait: show the newest text once it is over
+                self._pending_text = self._pending_text or text
+
+    async def _edit(self, text: str, final: bool = False) -> int:
+        """
+        Edit the message unless it already shows text.
+
+        Returns:
+            int: Seconds to wait before retrying if Telegram asked
+            to slow down, otherwise 0.
+        """
+        if text == self._last_text:
+            return 0
+        try:
+            await update_progress(
+                self.bot, text, self.chat_id, self.message_id, final
+            )
+            self._last_text = text
+        except TelegramRetryAfter as e:
+            logger.warning(f"Progress updates paused for {e.retry_after}s")
+            self._last_edit_at = time.monotonic() + e.retry_after
+            return e.retry_after
+        except TelegramBadRequest as e:
+            logger.warning(f"Failed to update progress: {e}")
+        self._last_edit_at = time.monotonic()
+        return 0
@@ -1,10 +1,8 @@
-import os
-
 import eyed3
 
 
 def add_metadata_to_track(
-    file_path: str, track_info: dict, cover_path: str
+    file_path: str, track_info: dict, cover_data: bytes | None = None
 ) -> None:
     """
     Adds metadata to an audio track file.
@@ -12,8 +10,8 @@ def add_metadata_to_track(
     Args:
         file_path (str): The path to the audio file to update.
         track_info (dict): A dictionary containing track information.
-        cover_path (str): The path to the cover image file to
-        embed in the audio file.
+        cover_data (bytes | None): The JPEG cover image to embed
+        in the audio file.
 
     Raises:
         AssertionError: If the audio file or its tag is not found.
@@ -38,9 +36,7 @@ def add_metadata_to_track(
 
     audiofile.tag.track_num = (track_number, total_tracks)
 
-    if cover_path and os.path.exists(cover_path):
-        with open(cover_path, "rb") as image_file:
-            imagedata = image_file.read()
-        audiofile.tag.images.set(3, imagedata, "image/jpeg", "cover")
+    if cover_data:
+        audiofile.tag.images.set(3, cover_data, "image/jpeg", "cover")
 
     audiofile.tag.save()
@@ -0,0 +1,96 @@
+import json
+import sqlite3
+import time
+from contextlib import closing
+from dataclasses import dataclass, field
+
+from config import PLAYLIST_SYNC_TTL
+from utils.storage import connect
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS playlist_syncs (
+        user_id INTEGER NOT NULL,
+        playlist_id TEXT NOT NULL,
+        snapshot_id TEXT,
+        track_ids TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (user_id, playlist_id)
+    )
+"""
+
+
+@dataclass
+class PlaylistSync:
+    """
+    What a user got from a playlist the last time they sent it.
+    """
+
+    # Snapshot the user has all tracks of, None after a partial delivery
+    snapshot_id: str | None
+    track_ids: set[str] = field(default_factory=set)
+
+
+def _connect() -> sqlite3.Connection:
+    connection = connect()
+    connection.execute(_SCHEMA)
+    return connection
+
+
+def get_playlist_sync(user_id: int, playlist_id: str) -> PlaylistSync | None:
+    """
+    Look up what a user got from a playlist before.
+
+    Args:
+        user_id (int): The Telegram user ID.
+        playlist_id (str): Spotify playlist ID.
+
+    Returns:
+        PlaylistSync | None: The last sync, or None if the user has not
+        sent the playlist within PLAYLIST_SYNC_TTL seconds.
+    """
+    with closing(_connect()) as connection:
+        row = connection.execute(
+            "SELECT snapshot_id, track_ids FROM playlist_syncs "
+            "WHERE user_id = ? AND playlist_id = ? AND updated_at >= ?",
+            (user_id, playlist_id, time.time() - PLAYLIST_SYNC_TTL),
+        ).fetchone()
+    if row is None:
+        return None
+    return PlaylistSync(row[0], set(json.loads(row[1])))
+
+
+def save_playlist_sync(
+    user_id: int,
+    playlist_id: str,
+    snapshot_id: str | None,
+    track_ids: set[str],
+) -> None:
+    """
+    Remember what a user got from a playlist, and forget syncs older
+    than PLAYLIST_SYNC_TTL seconds.
+
+    Args:
+        user_id (int): The Telegram user ID.
+        playlist_id (str): Spotify playlist ID.
+        snapshot_id (str | None): Snapshot the user now has all tracks
+        of, None if some tracks could not be delivered.
+        track_ids (set[str]): IDs of the playlist tracks the user has.
+    """
+    now = time.time()
+    with closing(_connect()) as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO playlist_syncs "
+            "(user_id, playlist_id, snapshot_id, track_ids, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                user_id,
+                playlist_id,
+                snapshot_id,
+                json.dumps(sorted(track_ids)),
+                now,
+            ),
+        )
+        connection.execute(
+            "DELETE FROM playlist_syncs WHERE updated_at < ?",
+            (now - PLAYLIST_SYNC_TTL,),
+        )
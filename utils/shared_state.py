@@ -0,0 +1,108 @@
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+
+from config import UPDATE_DEDUP_WINDOW
+from utils.storage import connect
+
+# Identifies this process among all workers sharing the state database
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS seen_updates (
+        update_id INTEGER PRIMARY KEY,
+        seen_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS locks (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """,
+)
+
+
+def _connect() -> sqlite3.Connection:
+    connection = connect()
+    for statement in _SCHEMA:
+        connection.execute(statement)
+    return connection
+
+
+def is_update_seen(update_id: int) -> bool:
+    """
+    Check whether an update was received by any of the workers within
+    the last UPDATE_DEDUP_WINDOW seconds.
+
+    Args:
+        update_id (int): The Telegram update ID.
+
+    Returns:
+        bool: True if the update was seen before.
+    """
+    with closing(_connect()) as connection:
+        row = connection.execute(
+            "SELECT 1 FROM seen_updates WHERE update_id = ? AND seen_at >= ?",
+            (update_id, time.time() - UPDATE_DEDUP_WINDOW),
+        ).fetchone()
+    return row is not None
+
+
+def mark_update_seen(update_id: int) -> bool:
+    """
+    Record that an update was received by any of the workers.
+
+    Updates are remembered for UPDATE_DEDUP_WINDOW seconds, which covers
+    Telegram's redeliveries.
+
+    Args:
+        update_id (int): The Telegram update ID.
+
+    Returns:
+        bool: True if the update is new, False if it was seen before.
+    """
+    now = time.time()
+    with closing(_connect()) as connection:
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO seen_updates (update_id, seen_at) "
+            "VALUES (?, ?)",
+            (update_id, now),
+        )
+        is_new = cursor.rowcount == 1
+        if is_new:
+            connection.execute(
+                "DELETE FROM seen_updates WHERE seen_at < ?",
+                (now - UPDATE_DEDUP_WINDOW,),
+            )
+    return is_new
+
+
+def try_acquire_lock(name: str, ttl: float, owner: str = WORKER_ID) -> bool:
+    """
+    Try to take a named lock shared by all workers. The lock expires
+    after ttl seconds unless its owner acquires it again.
+
+    Args:
+        name (str): Name of the lock.
+        ttl (float): Lifetime of the lock in seconds.
+        owner (str): Identifies the worker taking the lock.
+
+    Returns:
+        bool: True if owner now holds the lock.
+    """
+    now = time.time()
+    with closing(_connect()) as connection:
+        cursor = connection.execute(
+            "INSERT INTO locks (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET "
+            "owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE locks.owner = excluded.owner OR locks.expires_at < ?",
+            (name, owner, now + ttl, now),
+        )
+    return cursor.rowcount == 1
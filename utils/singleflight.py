@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into a single call.
+
+    The first caller for a key starts the call, callers arriving while it
+    is running wait for it and all of them get its result or exception.
+    A waiter that is cancelled does not cancel the shared call, since
+    other callers may still need its result.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def _forget(self, key: Hashable, call: asyncio.Future) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Nobody may be left waiting for a failed call
+        if not call.cancelled():
+            call.exception()
+
+    async def do(
+        self,
+        key: Hashable,
+        func: Callable[..., Awaitable[Any]],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        """
+        Run func(*args, **kwargs) unless a call for key is running,
+        and return the result of the running call.
+
+        Args:
+            key (Hashable): Identifies the work, e.g. a Spotify ID.
+            func (Callable[..., Awaitable[Any]]): Coroutine function
+            doing the work.
+            *args (Any): Positional arguments for func.
+            **kwargs (Any): Keyword arguments for func.
+
+        Returns:
+            Any: The result of the call.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = call
+            call.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            logger.info(f"Joining the running call for {key}")
+        return await asyncio.shield(call)
@@ -1,12 +1,10 @@
-import json
+from utils.singleflight import SingleFlight
+from utils.spotify.client import API_BASE_URL, spotify_get
+from utils.spotify.track_utils import get_several_tracks, get_tracks_info
 
-import requests
-
-from utils.spotify.track_utils import (
-    get_track,
-    get_track_id_by_url,
-    get_track_info,
-)
+# Album requests in progress, keyed by Spotify album ID
+_album_requests = SingleFlight()
+_album_tracks_requests = SingleFlight()
 
 
 def get_album_id_by_url(album_url: str) -> str:
@@ -22,53 +20,75 @@ def get_album_id_by_url(album_url: str) -> str:
     return album_url.split("/")[-1].split("?")[0]
 
 
-def get_album_title(headers: dict, album_id: str) -> str:
+async def get_album_data(headers: dict, album_id: str) -> dict:
     """
-    Extract the album title from a Spotify album.
+    Retrieve raw album information from the Spotify API.
+
+    The result also contains the first page of the album's tracks.
+    Concurrent requests for the same album share one API call.
 
     Args:
         headers (dict): Authorization header.
         album_id (str): Spotify album ID.
 
+    Returns:
+        dict: Raw JSON result from the Spotify API.
+    """
+    url = f"{API_BASE_URL}/albums/{album_id}"
+    return await _album_requests.do(album_id, spotify_get, url, headers)
+
+
+def get_album_title(album_data: dict) -> str:
+    """
+    Extract the album title from a Spotify album.
+
+    Args:
+        album_data (dict): Raw album information from get_album_data.
+
     Returns:
         str: album title.
     """
-    url = f"https://api.spotify.com/v1/albums/{album_id}"
-    result = requests.get(url, headers=headers)
-    json_result = json.loads(result.content)
-    return json_result["name"]
+    return album_data["name"]
 
 
-def get_album_tracks(headers: dict, album_id: str) -> list:
+async def get_album_tracks(headers: dict, album_data: dict) -> list:
     """
     Retrieve tracks information from a Spotify album.
 
+    Track IDs are collected from the album pages and resolved in batches.
+    Album-level fields (name, release date, cover, total tracks) are taken
+    from album_data, so no extra album requests are made. Concurrent
+    requests for the same album share one run.
+
     Args:
         headers (dict): Authorization header.
-        album_id (str): Spotify album ID.
+        album_data (dict): Raw album information from get_album_data.
 
     Returns:
         list: List of dictionaries containing track information.
     """
-    url = f"https://api.spotify.com/v1/albums/{album_id}/tracks"
-    tracks = []
+    return await _album_tracks_requests.do(
+        album_data["id"], _fetch_album_tracks, headers, album_data
+    )
+
 
-    while url:
-        result = requests.get(url, headers=headers)
-        json_result = result.json()
-        with open("result.json", "w") as json_file:
-            json.dump(json_result, json_file, indent=4, ensure_ascii=False)
+async def _fetch_album_tracks(headers: dict, album_data: dict) -> list:
+    page = album_data.get("tracks", {})
+    track_ids = []
 
-        if "items" not in json_result:
-            break
+    while page:
+        for item in page.get("items", []):
+            if item.get("id"):
+                track_ids.append(item["id"])
 
-        for item in json_result["items"]:
-            track_url = item["external_urls"]["spotify"]
-            track_id = get_track_id_by_url(track_url)
-            track_json_result = get_track(headers, track_id)
-            track_info = get_track_info(headers, track_json_result)
-            tracks.append(track_info)
+        url = page.get("next")  # Get the next URL to fetch more tracks
+        page = await spotify_get(url, headers) if url else {}
 
-        url = json_result.get("next")  # Get the next URL to fetch more tracks
+    album = {
+        key: value for key, value in album_data.items() if key != "tracks"
+    }
+    json_results = await get_several_tracks(headers, track_ids)
+    for track_json_result in json_results:
+        track_json_result["album"] = album
 
-    return tracks
+    return await get_tracks_info(headers, json_results)
@@ -1,34 +1,85 @@
+import asyncio
 import base64
-import json
-
-import requests
+import logging
+import time
 
 from config import CLIENT_ID, CLIENT_SECRET
+from utils.http_session import get_session
+
+logger = logging.getLogger(__name__)
+
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+# Refresh the token this many seconds before Spotify says it expires
+TOKEN_EXPIRY_MARGIN = 60
+
+_token: str | None = None
+_token_expires_at = 0.0
+# Makes concurrent callers wait for a single refresh instead of each
+# requesting its own token
+_token_lock = asyncio.Lock()
+
 
+def _is_token_valid(stale_token: str | None) -> bool:
+    return (
+        _token is not None
+        and _token != stale_token
+        and time.monotonic() < _token_expires_at - TOKEN_EXPIRY_MARGIN
+    )
 
-def get_token() -> str:
+
+async def _request_token() -> tuple[str, int]:
     """
-    Obtain an access token from the Spotify API using client credentials.
+    Request a new access token from the Spotify API
+    using client credentials.
 
     Returns:
-        str: Access token.
+        tuple[str, int]: Access token and its lifetime in seconds.
     """
     auth_string = f"{CLIENT_ID}:{CLIENT_SECRET}"
     auth_bytes = auth_string.encode("utf-8")
     auth_base64 = str(base64.b64encode(auth_bytes), "utf-8")
 
-    url = "https://accounts.spotify.com/api/token"
     headers = {
         "Authorization": "Basic " + auth_base64,
         "Content-Type": "application/x-www-form-urlencoded",
     }
     data = {"grant_type": "client_credentials"}
 
-    result = requests.post(url, headers=headers, data=data)
-    json_result = json.loads(result.content)
-    token = json_result["access_token"]
+    session = get_session()
+    async with session.post(TOKEN_URL, headers=headers, data=data) as result:
+        json_result = await result.json(content_type=None)
+
+    return json_result["access_token"], int(json_result["expires_in"])
+
+
+async def get_token(stale_token: str | None = None) -> str:
+    """
+    Obtain an access token for the Spotify API.
+
+    The token is cached for the whole process and refreshed shortly
+    before it expires. Concurrent callers share a single refresh.
+
+    Args:
+        stale_token (str | None): A token the caller knows to be rejected
+        by the API (e.g. after a 401). If it is still the cached one,
+        a new token is requested.
+
+    Returns:
+        str: Access token.
+    """
+    global _token, _token_expires_at
+    if _is_token_valid(stale_token):
+        return _token  # type: ignore
+
+    async with _token_lock:
+        # Another caller may have refreshed the token while we waited
+        if not _is_token_valid(stale_token):
+            token, expires_in = await _request_token()
+            _token = token
+            _token_expires_at = time.monotonic() + expires_in
+            logger.info(f"Obtained Spotify token valid for {expires_in}s")
 
-    return token
+    return _token  # type: ignore
 
 
 def get_auth_header(token: str) -> dict:
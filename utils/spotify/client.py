@@ -0,0 +1,85 @@
+import asyncio
+import logging
+
+from config import SPOTIFY_MAX_CONCURRENCY
+from utils.http_session import get_session
+from utils.spotify.auth import get_auth_header, get_token
+
+logger = logging.getLogger(__name__)
+
+API_BASE_URL = "https://api.spotify.com/v1"
+MAX_RETRIES = 3
+# Upper bound on IDs accepted by the multi-ID endpoints (tracks, artists)
+MAX_IDS_PER_REQUEST = 50
+
+# Caps the number of Spotify requests in flight across all handlers
+_semaphore = asyncio.Semaphore(SPOTIFY_MAX_CONCURRENCY)
+
+
+async def spotify_request(
+    url: str, headers: dict, params: dict | None = None
+) -> tuple[int, dict]:
+    """
+    Send a GET request to the Spotify Web API using the shared session.
+
+    Rate-limited responses (429) are retried after the delay
+    the API asks for in the Retry-After header. If the token expired
+    (401), a fresh one is obtained and the request is retried.
+
+    Args:
+        url (str): Full URL of the endpoint.
+        headers (dict): Authorization header. Updated in place when
+        the token is refreshed, so later calls reuse the new token.
+        params (dict | None): Optional query parameters.
+
+    Returns:
+        tuple[int, dict]: The HTTP status code and the decoded JSON body
+        (an empty dict if the body is not JSON).
+    """
+    session = get_session()
+    for attempt in range(MAX_RETRIES):
+        async with _semaphore:
+            async with session.get(
+                url, headers=headers, params=params
+            ) as response:
+                status = response.status
+                retry_after = response.headers.get("Retry-After", "1")
+                try:
+                    json_result = await response.json(content_type=None)
+                except ValueError:
+                    json_result = {}
+
+        if status == 401 and attempt < MAX_RETRIES - 1:
+            stale_token = headers.get("Authorization", "").removeprefix(
+                "Bearer "
+            )
+            logger.warning("Spotify token was rejected, refreshing")
+            token = await get_token(stale_token=stale_token)
+            headers.update(get_auth_header(token))
+            continue
+        if status == 429 and attempt < MAX_RETRIES - 1:
+            delay = int(retry_after) if retry_after.isdigit() else 1
+            logger.warning(f"Spotify rate limit hit, retrying in {delay}s")
+            await asyncio.sleep(delay)
+            continue
+        break
+
+    return status, json_result or {}
+
+
+async def spotify_get(
+    url: str, headers: dict, params: dict | None = None
+) -> dict:
+    """
+    Send a GET request to the Spotify Web API and return the JSON body.
+
+    Args:
+        url (str): Full URL of the endpoint.
+        headers (dict): Authorization header.
+        params (dict | None): Optional query parameters.
+
+    Returns:
+        dict: Decoded JSON body of the response.
+    """
+    _, json_result = await spotify_request(url, headers, params)
+    return json_result
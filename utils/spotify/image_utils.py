@@ -1,24 +1,72 @@
+import asyncio
+import logging
+
+import aiohttp
 import requests
 
+from config import COVER_CACHE_SIZE_MB
+from utils.cache import BytesLRUCache
+from utils.http_session import get_session
+from utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Cover images by URL. All tracks of an album share the same cover.
+_cover_cache = BytesLRUCache(COVER_CACHE_SIZE_MB * 1024 * 1024)
+_cover_requests = SingleFlight()
 
-def download_cover_image(url: str, output_path: str) -> str | None:
+
+def download_cover_image(url: str) -> bytes | None:
     """
-    Download the cover image from a given URL and
-    save it to the specified output path.
+    Download a cover image without the cover cache.
 
     Args:
         url (str): URL of the cover image.
-        output_path (str): Path where the image will be saved.
 
     Returns:
-        str | None: Path to the saved image or None if an error occurred.
+        bytes | None: The image data or None if an error occurred.
     """
     try:
-        response = requests.get(url)
-        with open(output_path, "wb") as file:
-            file.write(response.content)
-        return output_path
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        return response.content
     except requests.RequestException as e:
-        print(f"ERROR: {e}")
+        logger.error(f"Failed to download cover image {url}: {e}")
 
     return None
+
+
+async def _fetch_cover_image(url: str) -> bytes | None:
+    try:
+        async with get_session().get(url) as response:
+            response.raise_for_status()
+            data = await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Failed to download cover image {url}: {e}")
+        return None
+
+    _cover_cache.set(url, data)
+    return data
+
+
+async def get_cover_image(url: str) -> bytes | None:
+    """
+    Get a cover image, downloading it through the shared HTTP session
+    unless it is cached.
+
+    Concurrent requests for the same URL share one download, so all
+    tracks of an album fetch the cover once.
+
+    Args:
+        url (str): URL of the cover image.
+
+    Returns:
+        bytes | None: The image data or None if an error occurred.
+    """
+    if not url:
+        return None
+
+    data = _cover_cache.get(url)
+    if data is not None:
+        return data
+    return await _cover_requests.do(url, _fetch_cover_image, url)
@@ -1,8 +1,14 @@
-import json
+from typing import AsyncIterator
 
-import requests
+from utils.spotify.client import API_BASE_URL, spotify_get, spotify_request
+from utils.spotify.track_utils import get_tracks_info
 
-from utils.spotify.track_utils import get_track_info
+# Fields of the playlist items endpoint used to build track information,
+# leaving out large ones such as available_markets
+PLAYLIST_TRACK_FIELDS = (
+    "next,total,items(track(id,name,track_number,artists(id,name),"
+    "album(name,release_date,total_tracks,images(url))))"
+)
 
 
 def get_playlist_id_by_url(playlist_url: str) -> str:
@@ -18,55 +24,123 @@ def get_playlist_id_by_url(playlist_url: str) -> str:
     return playlist_url.split("/")[-1].split("?")[0]
 
 
-def get_playlist_title(headers: dict, playlist_id: str) -> str:
+async def get_playlist_details(headers: dict, playlist_id: str) -> dict:
     """
-    Extract the playlist title from a Spotify playlist.
+    Retrieve the name and the current snapshot ID of a Spotify playlist,
+    without its tracks.
+
+    The snapshot ID changes whenever the playlist is modified.
 
     Args:
         headers (dict): Authorization header.
         playlist_id (str): Spotify playlist ID.
 
     Returns:
-        str: Playlist title.
+        dict: The playlist's 'name', 'snapshot_id' and, under
+        'tracks', the 'total' number of tracks.
     """
-    url = f"https://api.spotify.com/v1/playlists/{playlist_id}"
-    result = requests.get(url, headers=headers)
-    json_result = json.loads(result.content)
-    return json_result["name"]
+    url = f"{API_BASE_URL}/playlists/{playlist_id}"
+    return await spotify_get(
+        url, headers, params={"fields": "name,snapshot_id,tracks.total"}
+    )
 
 
-def get_playlist_tracks(headers: dict, playlist_id: str) -> list:
+async def iter_playlist_tracks(
+    headers: dict, playlist_id: str
+) -> AsyncIterator[dict]:
     """
-    Retrieve tracks information from a Spotify playlist.
+    Yield tracks information from a Spotify playlist as its pages
+    arrive, so the first tracks can be processed while the rest of the
+    playlist is still being fetched.
+
+    Genres are resolved page by page. Artists are cached, so each one
+    is still requested at most once.
 
     Args:
         headers (dict): Authorization header.
         playlist_id (str): Spotify playlist ID.
 
-    Returns:
-        list: List of dictionaries containing track information.
+    Yields:
+        dict: Track information, in playlist order.
+    """
+    async for json_results in iter_playlist_pages(headers, playlist_id):
+        for track_info in await get_tracks_info(headers, json_results):
+            yield track_info
+
+
+async def iter_playlist_pages(
+    headers: dict, playlist_id: str
+) -> AsyncIterator[list]:
+    """
+    Yield the raw track objects of a Spotify playlist one page at a time.
+
+    Only the fields used to build track information are requested.
+
+    Args:
+        headers (dict): Authorization header.
+        playlist_id (str): Spotify playlist ID.
+
+    Yields:
+        list: Raw JSON track objects of one page, in playlist order.
+
+    Raises:
+        RuntimeError: If a page could not be fetched, so a partial
+        playlist is never taken for the whole one.
     """
-    url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-    tracks = []
+    url = f"{API_BASE_URL}/playlists/{playlist_id}/tracks"
+    params: dict | None = {"fields": PLAYLIST_TRACK_FIELDS}
 
     while url:
-        result = requests.get(url, headers=headers)
-        json_result = result.json()
+        status, json_result = await spotify_request(url, headers, params)
 
-        if "items" not in json_result:
-            break
+        if status != 200 or not isinstance(json_result.get("items"), list):
+            raise RuntimeError(
+                f"Failed to fetch tracks of playlist {playlist_id}: "
+                f"status {status}"
+            )
 
-        for item in json_result["items"]:
-            track = item["track"]
-            track_info = get_track_info(headers, track)
-            tracks.append(track_info)
+        # Removed and local tracks come back without a track object
+        yield [
+            item["track"] for item in json_result["items"] if item.get("track")
+        ]
 
-        url = json_result.get("next")  # Get the next URL to fetch more tracks
+        # The next URL already carries the query parameters
+        url = json_result.get("next")
+        params = None
 
-    return tracks
 
+async def get_new_playlist_items(
+    headers: dict, playlist_id: str, known_ids: set[str]
+) -> tuple[list, set[str]]:
+    """
+    Find the tracks of a Spotify playlist that are not in known_ids.
+
+    Only the new tracks are kept while the pages are walked.
 
-def is_playlist_accessible(headers: dict, playlist_id: str) -> bool:
+    Args:
+        headers (dict): Authorization header.
+        playlist_id (str): Spotify playlist ID.
+        known_ids (set[str]): IDs of the tracks that are not new.
+
+    Returns:
+        tuple[list, set[str]]: The raw JSON objects of the new tracks,
+        in playlist order, and the IDs of all tracks in the playlist.
+        Tracks without an ID are never new.
+    """
+    new_results = []
+    playlist_ids = set()
+    async for json_results in iter_playlist_pages(headers, playlist_id):
+        for json_result in json_results:
+            track_id = json_result.get("id")
+            if not track_id:
+                continue
+            playlist_ids.add(track_id)
+            if track_id not in known_ids:
+                new_results.append(json_result)
+    return new_results, playlist_ids
+
+
+async def is_playlist_accessible(headers: dict, playlist_id: str) -> bool:
     """
     Check if a Spotify playlist is accessible.
 
@@ -82,6 +156,6 @@ def is_playlist_accessible(headers: dict, playlist_id: str) -> bool:
     Returns:
         bool: True if the playlist is accessible, False otherwise.
     """
-    url = f"https://api.spotify.com/v1/playlists/{playlist_id}"
-    response = requests.get(url, headers=headers)
-    return response.status_code == 200
+    url = f"{API_BASE_URL}/playlists/{playlist_id}"
+    status, _ = await spotify_request(url, headers, params={"fields": "id"})
+    return status == 200
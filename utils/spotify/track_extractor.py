@@ -1,6 +1,26 @@
-import json
+from config import GENRE_CACHE_SIZE, GENRE_CACHE_TTL
+from utils.cache import TTLCache
+from utils.spotify.client import (
+    API_BASE_URL,
+    MAX_IDS_PER_REQUEST,
+    spotify_get,
+)
 
-import requests
+# Genres of each artist, shared by all requests handled by this process
+_artist_genres_cache = TTLCache(maxsize=GENRE_CACHE_SIZE, ttl=GENRE_CACHE_TTL)
+
+
+def get_track_id(json_result: dict) -> str:
+    """
+    Extracts the Spotify track ID from the JSON result.
+
+    Args:
+        json_result (dict): The JSON result from the Spotify API.
+
+    Returns:
+        str: The track ID, or an empty string if not found.
+    """
+    return json_result.get("id") or ""
 
 
 def get_title(json_result: dict) -> str:
@@ -59,31 +79,80 @@ def get_release_date(json_result: dict) -> str:
     return json_result.get("album", {}).get("release_date", "Unknown")
 
 
-def get_genres(json_result: dict, headers: dict) -> str:
+def get_artist_id(json_result: dict) -> str:
     """
-    Extracts the genres from the artist is associated with.
+    Extracts the ID of the main artist from the JSON result.
 
     Args:
         json_result (dict): The JSON result from the Spotify API.
-        headers (dict): Authorization header.
 
     Returns:
-        str: A comma-separated string of genres,
-        or an empty string if not found.
+        str: The artist ID, or an empty string if not found.
     """
     artists = json_result.get("artists", [])
     if not artists:
-        return "Unknown"
+        return ""
+    return artists[0].get("id") or ""
 
-    artists_id = artists[0].get("id", "")
-    if not artists_id:
-        return "Unknown"
 
-    url = f"https://api.spotify.com/v1/artists/{artists_id}"
-    result = requests.get(url, headers=headers)
-    json_result = json.loads(result.content)
+async def get_artists_genres(
+    headers: dict, artist_ids: list[str]
+) -> dict[str, list[str]]:
+    """
+    Retrieves the genres of the given artists.
+
+    Artists missing from the cache are fetched in batches
+    using the multi-ID artists endpoint.
+
+    Args:
+        headers (dict): Authorization header.
+        artist_ids (list[str]): Spotify artist IDs, may contain duplicates.
+
+    Returns:
+        dict[str, list[str]]: Genres of each artist, keyed by artist ID.
+    """
+    artists_genres = {}
+    missing_ids = []
+    for artist_id in dict.fromkeys(filter(None, artist_ids)):
+        genres = _artist_genres_cache.get(artist_id)
+        if genres is None:
+            missing_ids.append(artist_id)
+        else:
+            artists_genres[artist_id] = genres
+
+    url = f"{API_BASE_URL}/artists"
+    for start in range(0, len(missing_ids), MAX_IDS_PER_REQUEST):
+        batch = missing_ids[start : start + MAX_IDS_PER_REQUEST]
+        json_result = await spotify_get(
+            url, headers, params={"ids": ",".join(batch)}
+        )
+        for artist in json_result.get("artists", []):
+            if artist:
+                genres = artist.get("genres", [])
+                _artist_genres_cache.set(artist["id"], genres)
+                artists_genres[artist["id"]] = genres
+
+    return artists_genres
+
+
+def get_genres(json_result: dict, artists_genres: dict) -> str:
+    """
+    Extracts the genres from the artist is associated with.
+
+    Args:
+        json_result (dict): The JSON result from the Spotify API.
+        artists_genres (dict): Genres keyed by artist ID,
+        as returned by get_artists_genres.
+
+    Returns:
+        str: A comma-separated string of genres,
+        or "Unknown" if not found.
+    """
+    artist_id = get_artist_id(json_result)
+    if not artist_id:
+        return "Unknown"
 
-    genres = json_result.get("genres", [])
+    genres = artists_genres.get(artist_id, [])
     if not genres:
         return "Unknown"
     return ", ".join(genres)
@@ -1,23 +1,33 @@
-import json
-
-import requests
-
+from utils.singleflight import SingleFlight
+from utils.spotify.client import (
+    API_BASE_URL,
+    MAX_IDS_PER_REQUEST,
+    spotify_get,
+)
 from utils.spotify.track_extractor import (
     get_album,
+    get_artist_id,
     get_artists,
+    get_artists_genres,
     get_cover_url,
     get_genres,
     get_release_date,
     get_title,
     get_total_tracks,
+    get_track_id,
     get_track_number,
 )
 
+# Track requests in progress, keyed by Spotify track ID
+_track_requests = SingleFlight()
 
-def get_track(headers: dict, track_id: str) -> dict:
+
+async def get_track(headers: dict, track_id: str) -> dict:
     """
     Retrieve raw track information from the Spotify API.
 
+    Concurrent requests for the same track share one API call.
+
     Args:
         headers (dict): Authorization header.
         track_id (str): Spotify track ID.
@@ -25,10 +35,36 @@ def get_track(headers: dict, track_id: str) -> dict:
     Returns:
         dict: Raw JSON result from the Spotify API.
     """
-    url = f"https://api.spotify.com/v1/tracks/{track_id}"
-    result = requests.get(url, headers=headers)
-    json_result = json.loads(result.content)
-    return json_result
+    url = f"{API_BASE_URL}/tracks/{track_id}"
+    return await _track_requests.do(track_id, spotify_get, url, headers)
+
+
+async def get_several_tracks(headers: dict, track_ids: list[str]) -> list:
+    """
+    Retrieve raw information for many tracks with as few requests
+    as possible, using the multi-ID tracks endpoint.
+
+    Args:
+        headers (dict): Authorization header.
+        track_ids (list[str]): Spotify track IDs.
+
+    Returns:
+        list: Raw JSON track objects in the order of track_ids.
+        Tracks that Spotify could not find are skipped.
+    """
+    url = f"{API_BASE_URL}/tracks"
+    tracks = []
+
+    for start in range(0, len(track_ids), MAX_IDS_PER_REQUEST):
+        batch = track_ids[start : start + MAX_IDS_PER_REQUEST]
+        json_result = await spotify_get(
+            url, headers, params={"ids": ",".join(batch)}
+        )
+        tracks.extend(
+            track for track in json_result.get("tracks", []) if track
+        )
+
+    return tracks
 
 
 def get_track_id_by_url(track_url: str) -> str:
@@ -44,27 +80,30 @@ def get_track_id_by_url(track_url: str) -> str:
     return track_url.split("/")[-1].split("?")[0]
 
 
-def get_track_info(headers: dict, json_result: dict) -> dict:
+def build_track_info(json_result: dict, artists_genres: dict) -> dict:
     """
-    Retrieve track information from the json_result.
+    Build track information from the json_result.
 
     Args:
-        headers (dict): Authorization header.
         json_result (dict): The JSON result from the Spotify API.
+        artists_genres (dict): Genres keyed by artist ID,
+        as returned by get_artists_genres.
 
     Returns:
         dict: Dictionary containing track information.
     """
+    track_id = get_track_id(json_result)
     title = get_title(json_result)
     album = get_album(json_result)
     artists = get_artists(json_result)
     release_date = get_release_date(json_result)
-    genres = get_genres(json_result, headers)
+    genres = get_genres(json_result, artists_genres)
     cover_url = get_cover_url(json_result)
     track_number = get_track_number(json_result)
     total_tracks = get_total_tracks(json_result)
 
     track_info = {
+        "id": track_id,
         "title": title,
         "album": album,
         "artists": artists,
@@ -76,3 +115,40 @@ def get_track_info(headers: dict, json_result: dict) -> dict:
     }
 
     return track_info
+
+
+async def get_tracks_info(headers: dict, json_results: list) -> list:
+    """
+    Retrieve track information for many tracks at once.
+
+    The genres of all artists involved are looked up together,
+    so each artist is requested at most once.
+
+    Args:
+        headers (dict): Authorization header.
+        json_results (list): JSON track objects from the Spotify API.
+
+    Returns:
+        list: List of dictionaries containing track information.
+    """
+    artist_ids = [get_artist_id(json_result) for json_result in json_results]
+    artists_genres = await get_artists_genres(headers, artist_ids)
+    return [
+        build_track_info(json_result, artists_genres)
+        for json_result in json_results
+    ]
+
+
+async def get_track_info(headers: dict, json_result: dict) -> dict:
+    """
+    Retrieve track information from the json_result.
+
+    Args:
+        headers (dict): Authorization header.
+        json_result (dict): The JSON result from the Spotify API.
+
+    Returns:
+        dict: Dictionary containing track information.
+    """
+    tracks_info = await get_tracks_info(headers, [json_result])
+    return tracks_info[0]
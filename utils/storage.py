@@ -0,0 +1,29 @@
+import os
+import sqlite3
+
+from config import SQLITE_JOURNAL_MODE, STATE_DB_PATH
+
+
+def connect(db_path: str = STATE_DB_PATH) -> sqlite3.Connection:
+    """
+    Open a connection to the bot's SQLite state database.
+
+    The database is shared by all worker processes, so it runs in WAL
+    mode (see SQLITE_JOURNAL_MODE) and waits for locks instead of failing
+    right away.
+    Connections are cheap and must not be shared between processes;
+    open one per operation.
+
+    Args:
+        db_path (str): Path to the database file.
+
+    Returns:
+        sqlite3.Connection: A connection in autocommit mode
+        that returns rows as sqlite3.Row.
+    """
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    connection = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
@@ -5,6 +5,11 @@ import requests
 
 logger = logging.getLogger(__name__)
 
+# Largest file a bot can upload through the hosted Bot API
+# and through a local Bot API server
+HOSTED_API_UPLOAD_LIMIT = 50 * 1024 * 1024
+LOCAL_API_UPLOAD_LIMIT = 2000 * 1024 * 1024
+
 
 def check_telegram_bot_api_server(
     url: str | None, token: str, timeout=30
@@ -0,0 +1,258 @@
+import asyncio
+import itertools
+import logging
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    EditMessageText,
+    SendAudio,
+    SendChatAction,
+    SendDocument,
+    SendMessage,
+    TelegramMethod,
+)
+from aiogram.methods.base import Response, TelegramType
+
+from config import (
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_MAX_RETRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+# Lower values are sent first
+PRIORITY_UPLOAD = 0
+PRIORITY_MESSAGE = 1
+# Final status and summary edits of a progress message
+PRIORITY_FINAL = 2
+PRIORITY_CHAT_ACTION = 3
+PRIORITY_PROGRESS = 4
+
+_PRIORITIES = {
+    SendAudio: PRIORITY_UPLOAD,
+    SendDocument: PRIORITY_UPLOAD,
+    SendMessage: PRIORITY_MESSAGE,
+    SendChatAction: PRIORITY_CHAT_ACTION,
+    EditMessageText: PRIORITY_PROGRESS,
+}
+
+# Short bursts a single chat may send before being throttled
+CHAT_BURST = 3
+
+# Priority of the calls made in the current context, overriding the one
+# of their method
+_priority_override: ContextVar[int | None] = ContextVar(
+    "outbound_priority", default=None
+)
+
+
+@contextmanager
+def outbound_priority(priority: int) -> Iterator[None]:
+    """
+    Send the Bot API calls made inside the block with the given
+    priority, whatever their method.
+
+    Args:
+        priority (int): One of the PRIORITY_* values.
+    """
+    token = _priority_override.set(priority)
+    try:
+        yield
+    finally:
+        _priority_override.reset(token)
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter that can be paused for a while,
+    e.g. when Telegram asks to retry after some time.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        """
+        Args:
+            rate (float): Tokens added per second.
+            capacity (float): Maximum number of tokens.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def get_delay(self, now: float) -> float:
+        """
+        Return the time in seconds until a token is available.
+        """
+        self._refill(now)
+        delay = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            delay = max(delay, (1 - self.tokens) / self.rate)
+        return delay
+
+    def consume(self, now: float) -> None:
+        """
+        Take one token from the bucket.
+        """
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hand out no tokens for the given number of seconds.
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    sequence: int
+    chat_id: int | str = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Queues outgoing Bot API calls that target a chat and sends them
+    within Telegram's global and per-chat rate limits.
+
+    Uploads and regular messages are sent before final status edits,
+    chat actions and progress edits. Calls rejected by flood control
+    are retried after the delay Telegram asks for.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        chat_rate: float = TELEGRAM_CHAT_RATE,
+        max_retries: int = TELEGRAM_MAX_RETRIES,
+    ) -> None:
+        """
+        Args:
+            global_rate (float): Calls per second across all chats.
+            chat_rate (float): Calls per second to a single chat.
+            max_retries (int): Retries of a call rejected by
+            flood control.
+        """
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self._global_bucket = TokenBucket(global_rate, max(1, global_rate))
+        self._chat_buckets: dict[int | str, TokenBucket] = {}
+        self._waiters: list[_Waiter] = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: asyncio.Task | None = None
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        priority = _priority_override.get()
+        if priority is None:
+            priority = _PRIORITIES.get(type(method), PRIORITY_MESSAGE)
+        retries = 0
+        while True:
+            await self._acquire(priority, chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                retries += 1
+                if retries > self.max_retries:
+                    raise
+                logger.warning(
+                    f"Flood control for chat {chat_id}, "
+                    f"retrying in {e.retry_after}s"
+                )
+                self._get_chat_bucket(chat_id).pause(e.retry_after)
+
+    def _get_chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, CHAT_BURST)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, priority: int, chat_id: int | str) -> None:
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(priority, next(self._sequence), chat_id, future)
+        self._waiters.append(waiter)
+        self._waiters.sort()
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    def _grant_next(self, now: float) -> float:
+        """
+        Let the most important waiter whose chat is not throttled go.
+
+        Returns:
+            float: 0 if a waiter was let go, otherwise the time
+            in seconds until one of them can be.
+        """
+        delay = self._global_bucket.get_delay(now)
+        if delay > 0:
+            return delay
+
+        delay = math.inf
+        for waiter in list(self._waiters):
+            if waiter.future.done():
+                # The caller gave up waiting
+                self._waiters.remove(waiter)
+                continue
+
+            bucket = self._get_chat_bucket(waiter.chat_id)
+            chat_delay = bucket.get_delay(now)
+            if chat_delay == 0:
+                bucket.consume(now)
+                self._global_bucket.consume(now)
+                self._waiters.remove(waiter)
+                waiter.future.set_result(None)
+                return 0
+            delay = min(delay, chat_delay)
+        return delay
+
+    async def _dispatch(self) -> None:
+        while self._waiters:
+            self._wakeup.clear()
+            delay = self._grant_next(time.monotonic())
+            if delay == 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+        # Chats that are not throttled need no state
+        now = time.monotonic()
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if bucket.is_idle(now):
+                del self._chat_buckets[chat_id]
@@ -0,0 +1,281 @@
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing
+
+from config import MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_SIZE_MB, OUTPUT_FORMAT
+from utils.audio_utils import get_encoding_profile
+from utils.storage import connect
+
+logger = logging.getLogger(__name__)
+
+TRACKS_CACHE_DIR = os.path.join(MEDIA_CACHE_DIR, "tracks")
+TEMP_DIR = os.path.join(MEDIA_CACHE_DIR, "tmp")
+HASH_CHUNK_SIZE = 1024 * 1024
+# Tracks looked up this recently are never evicted, so a job can link
+# a track it just found in the cache
+EVICTION_GRACE = 300
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    track_id TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+)
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    connection = connect()
+    connection.execute(_SCHEMA)
+    columns = {
+        row["name"] for row in connection.execute("PRAGMA table_info(tracks)")
+    }
+    # Added after the table was first created
+    if "mtime_ns" not in columns:
+        connection.execute("ALTER TABLE tracks ADD COLUMN mtime_ns INTEGER")
+    return connection
+
+
+def _get_cache_id(track_id: str, output_format: str) -> str:
+    # MP3 entries at the default bitrate keep the plain track ID they
+    # were cached under before other formats existed
+    profile = get_encoding_profile(output_format)
+    if profile == "mp3":
+        return track_id
+    return f"{track_id}:{profile}"
+
+
+def get_file_hash(file_path: str) -> str:
+    """
+    Compute the SHA-256 hash of a file.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        str: Hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_cached_track(
+    track_id: str, output_format: str = OUTPUT_FORMAT
+) -> str | None:
+    """
+    Look up a finished track in the cache.
+
+    The cached file is checked against the size and modification time
+    recorded when it was cached, and entries whose file is missing or
+    was changed are dropped. Entries cached before the modification time
+    was recorded are checked against their hash once.
+
+    Args:
+        track_id (str): Spotify track ID.
+        output_format (str): Output format of the track.
+
+    Returns:
+        str | None: Path to the cached file, or None on a cache miss.
+    """
+    track_id = _get_cache_id(track_id, output_format)
+    with closing(_connect()) as connection:
+        row = connection.execute(
+            "SELECT sha256, path, size, mtime_ns FROM tracks "
+            "WHERE track_id = ?",
+            (track_id,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        path = row["path"]
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+        if row["mtime_ns"] is None and stat is not None:
+            is_valid = get_file_hash(path) == row["sha256"]
+        else:
+            is_valid = (
+                stat is not None
+                and stat.st_size == row["size"]
+                and stat.st_mtime_ns == row["mtime_ns"]
+            )
+        if not is_valid:
+            logger.warning(f"Dropping invalid cache entry for {track_id}")
+            connection.execute(
+                "DELETE FROM tracks WHERE track_id = ?", (track_id,)
+            )
+            return None
+
+        connection.execute(
+            "UPDATE tracks SET last_access = ?, size = ?, mtime_ns = ? "
+            "WHERE track_id = ?",
+            (time.time(), stat.st_size, stat.st_mtime_ns, track_id),
+        )
+    return path
+
+
+def cache_track(
+    track_id: str, file_path: str, output_format: str = OUTPUT_FORMAT
+) -> str:
+    """
+    Move a finished track into the cache.
+
+    The file is stored under its content hash and only becomes visible
+    once it is fully written, so a partial file is never served. Its
+    size and modification time are recorded, so lookups can tell
+    whether it changed without hashing it again.
+
+    Args:
+        track_id (str): Spotify track ID.
+        file_path (str): Path to the finished, tagged track. The file
+        is moved, so it should live on the same file system as the cache.
+        output_format (str): Output format of the track.
+
+    Returns:
+        str: Path to the cached file.
+    """
+    track_id = _get_cache_id(track_id, output_format)
+    os.makedirs(TRACKS_CACHE_DIR, exist_ok=True)
+    sha256 = get_file_hash(file_path)
+    _, extension = os.path.splitext(file_path)
+    cached_path = os.path.join(TRACKS_CACHE_DIR, f"{sha256}{extension}")
+
+    if os.path.exists(cached_path):
+        os.remove(file_path)
+    else:
+        os.replace(file_path, cached_path)
+
+    stat = os.stat(cached_path)
+    now = time.time()
+    with closing(_connect()) as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO tracks "
+            "(track_id, sha256, path, size, mtime_ns, created_at, "
+            "last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                track_id,
+                sha256,
+                cached_path,
+                stat.st_size,
+                stat.st_mtime_ns,
+                now,
+                now,
+            ),
+        )
+    logger.info(f"Cached track {track_id} as {cached_path}")
+
+    evict_tracks()
+    return cached_path
+
+
+def get_cache_size() -> int:
+    """
+    Get the total size of the cached tracks.
+
+    Returns:
+        int: Size in bytes.
+    """
+    with closing(_connect()) as connection:
+        return _get_cache_size(connection)
+
+
+def _get_cache_size(connection: sqlite3.Connection) -> int:
+    # Tracks with the same content share one file
+    row = connection.execute(
+        "SELECT COALESCE(SUM(size), 0) FROM "
+        "(SELECT DISTINCT path, size FROM tracks)"
+    ).fetchone()
+    return row[0]
+
+
+def evict_tracks(max_size: int = MEDIA_CACHE_MAX_SIZE_MB * 1024 * 1024) -> int:
+    """
+    Remove the least recently used tracks until the cache fits max_size.
+
+    A cached file is referenced by a hard link from every job directory
+    it was linked into, so files with more than one link belong to
+    running jobs and are kept. Tracks looked up within EVICTION_GRACE
+    seconds are kept as well.
+
+    Args:
+        max_size (int): Size limit of the cache in bytes, 0 for no limit.
+
+    Returns:
+        int: Number of bytes freed.
+    """
+    if not max_size:
+        return 0
+
+    freed = 0
+    with closing(_connect()) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            excess = _get_cache_size(connection) - max_size
+            rows = connection.execute(
+                "SELECT track_id, path, size FROM tracks "
+                "WHERE last_access < ? ORDER BY last_access",
+                (time.time() - EVICTION_GRACE,),
+            ).fetchall()
+            for row in rows:
+                if freed >= excess:
+                    break
+                path = row["path"]
+                try:
+                    if os.stat(path).st_nlink > 1:
+                        continue
+                except FileNotFoundError:
+                    pass
+
+                connection.execute(
+                    "DELETE FROM tracks WHERE track_id = ?",
+                    (row["track_id"],),
+                )
+                is_shared = connection.execute(
+                    "SELECT 1 FROM tracks WHERE path = ?", (path,)
+                ).fetchone()
+                if not is_shared:
+                    if os.path.exists(path):
+                        os.remove(path)
+                    freed += row["size"]
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    if freed:
+        logger.info(f"Evicted {freed} bytes of cached tracks")
+    return freed
+
+
+def link_track(cached_path: str, output_path: str) -> str:
+    """
+    Make a cached track available at output_path without copying it
+    where possible. Falls back to a copy if hard links are not supported.
+
+    Args:
+        cached_path (str): Path to the cached file.
+        output_path (str): Where the track should appear.
+
+    Returns:
+        str: output_path.
+    """
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        os.link(cached_path, temp_path)
+    except OSError:
+        shutil.copyfile(cached_path, temp_path)
+    os.replace(temp_path, output_path)
+    return output_path
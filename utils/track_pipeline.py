@@ -0,0 +1,329 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Hashable,
+    Iterable,
+)
+
+from config import (
+    LARGE_JOB_OUTPUT_FORMAT,
+    LARGE_JOB_TRACKS,
+    OUTPUT_FORMAT,
+    SMALL_JOB_TRACKS,
+    TRACK_CONCURRENCY,
+    TRACK_TIMEOUT,
+    USER_MAX_TRACKS,
+    WORKER_POOL_SIZE,
+)
+from utils.fair_scheduler import FairScheduler
+from utils.singleflight import SingleFlight
+from utils.spotify.image_utils import get_cover_image
+from utils.track_cache import get_cached_track, link_track
+from utils.track_processor import get_track_path, process_track
+from utils.youtube_utils import search_youtube_async
+from utils.worker_pool import worker_pool
+
+logger = logging.getLogger(__name__)
+
+# Keeps the summary well below Telegram's message length limit
+MAX_LISTED_FAILURES = 30
+
+# Hands out the worker processes fairly between the users' jobs
+track_scheduler = FairScheduler(WORKER_POOL_SIZE, USER_MAX_TRACKS)
+# Downloads in progress, keyed by Spotify track ID and output format
+_track_downloads = SingleFlight()
+# Downloads in progress that a priority job is waiting for
+_priority_downloads: set[Hashable] = set()
+
+
+@dataclass
+class TrackResult:
+    """
+    Outcome of processing a single track of a playlist or album.
+    """
+
+    track_info: dict
+    track_path: str | None = None
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.track_path is not None
+
+    @property
+    def name(self) -> str:
+        return f"{self.track_info['artists']} - {self.track_info['title']}"
+
+
+ResultCallback = Callable[[TrackResult, int, int], Awaitable[None]]
+
+
+async def _download_track(
+    track_info: dict,
+    tracks_dir: str,
+    timeout: float,
+    user_id: Hashable,
+    priority: bool,
+    output_format: str,
+    key: Hashable = None,
+) -> TrackResult:
+    title = track_info["title"]
+    search_query = f"{title} {track_info['artists']}"
+    try:
+        youtube_track_url = await search_youtube_async(
+            search_query, track_info.get("id")
+        )
+        if not youtube_track_url:
+            return TrackResult(track_info, error="not found on YouTube")
+
+        cover_data = await get_cover_image(track_info["cover_url"])
+        # A priority job may have joined the download in the meantime
+        priority = priority or key in _priority_downloads
+        async with track_scheduler.slot(user_id, priority=priority, key=key):
+            track_path = await worker_pool.run(
+                process_track,
+                track_info,
+                tracks_dir,
+                youtube_track_url,
+                cover_data,
+                output_format,
+                timeout=timeout,
+            )
+    finally:
+        _priority_downloads.discard(key)
+    if track_path is None:
+        return TrackResult(track_info, error="not found")
+    return TrackResult(track_info, track_path)
+
+
+async def run_track(
+    track_info: dict,
+    tracks_dir: str,
+    timeout: float = TRACK_TIMEOUT,
+    user_id: Hashable = None,
+    priority: bool = False,
+    output_format: str = OUTPUT_FORMAT,
+) -> TrackResult:
+    """
+    Process a single track.
+
+    Cached tracks, YouTube searches and cover images are resolved on the
+    event loop, only downloading and tagging is handed to a worker
+    process, once track_scheduler gives the user a turn. Jobs asking for
+    a track that is already being downloaded wait for that download and
+    take the track from the cache, a priority job moving that download
+    ahead of the rotation.
+
+    Args:
+        track_info (dict): Information about the track.
+        tracks_dir (str): Directory where the downloaded track
+        will be stored.
+        timeout (float): Maximum time in seconds spent in the worker.
+        user_id (Hashable): The user the track is processed for.
+        priority (bool): Whether the track belongs to a small job that
+        goes ahead of the rotation.
+        output_format (str): One of "mp3", "m4a" or "copy".
+
+    Returns:
+        TrackResult: The outcome of processing the track.
+    """
+    track_id = track_info.get("id")
+    title = track_info["title"]
+    try:
+        if not track_id:
+            return await _download_track(
+                track_info,
+                tracks_dir,
+                timeout,
+                user_id,
+                priority,
+                output_format,
+            )
+
+        track_path = get_track_path(track_info, tracks_dir, output_format)
+        cached_path = await asyncio.to_thread(
+            get_cached_track, track_id, output_format
+        )
+        if not cached_path:
+            key = (track_id, output_format)
+            if priority and key in _track_downloads:
+                # Upgrade the download another job started
+                _priority_downloads.add(key)
+                track_scheduler.promote(key)
+            result = await _track_downloads.do(
+                key,
+                _download_track,
+                track_info,
+                tracks_dir,
+                timeout,
+                user_id,
+                priority,
+                output_format,
+                key,
+            )
+            if not result.ok or result.track_path == track_path:
+                return TrackResult(track_info, result.track_path, result.error)
+
+            # The track was downloaded for another job
+            cached_path = await asyncio.to_thread(
+                get_cached_track, track_id, output_format
+            )
+            if not cached_path:
+                return TrackResult(track_info, error="not cached")
+
+        await asyncio.to_thread(link_track, cached_path, track_path)
+    except asyncio.TimeoutError:
+        logger.warning(f"Track timed out after {timeout}s: {title}")
+        return TrackResult(track_info, error="timed out")
+    except Exception as e:
+        logger.error(f"Track failed: {title}: {e}")
+        return TrackResult(track_info, error=str(e))
+
+    return TrackResult(track_info, track_path)
+
+
+async def process_tracks(
+    tracks_info: Iterable[dict] | AsyncIterable[dict],
+    tracks_dir: str,
+    on_result: ResultCallback | None = None,
+    concurrency: int = TRACK_CONCURRENCY,
+    timeout: float = TRACK_TIMEOUT,
+    user_id: Hashable = None,
+    output_format: str = OUTPUT_FORMAT,
+    total: int | None = None,
+) -> list[TrackResult]:
+    """
+    Process the tracks of a playlist or album, several at a time.
+
+    Tracks may arrive from an async iterator, such as a playlist being
+    fetched page by page. Each track starts as soon as it arrives, and
+    at most twice `concurrency` tracks are taken from the iterator ahead
+    of the ones that finished, so a long playlist is not fetched faster
+    than it is downloaded.
+    A track that takes longer than the timeout is reported as failed,
+    so one stuck download does not hold up the rest of the job.
+    Jobs of at most SMALL_JOB_TRACKS tracks get priority over larger ones.
+
+    Args:
+        tracks_info (Iterable[dict] | AsyncIterable[dict]): Track
+        information dictionaries.
+        tracks_dir (str): Directory where the downloaded tracks
+        will be stored.
+        on_result (ResultCallback | None): Awaited after each track
+        finishes with the result, the number of finished tracks
+        and the total number of tracks.
+        concurrency (int): Maximum number of tracks processed at once.
+        timeout (float): Maximum time in seconds spent on one track.
+        user_id (Hashable): The user the tracks are processed for.
+        output_format (str): One of "mp3", "m4a" or "copy".
+        total (int | None): Expected number of tracks, required when
+        tracks_info has no length. Corrected once all tracks arrived.
+
+    Returns:
+        list[TrackResult]: Results in the order of tracks_info.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    # Bounds the tracks taken from tracks_info that are not finished yet
+    window = asyncio.Semaphore(2 * max(1, concurrency))
+    if total is None:
+        total = len(tracks_info)  # type: ignore
+    finished = 0
+    priority = total <= SMALL_JOB_TRACKS
+    tasks: list[asyncio.Future] = []
+
+    async def run(track_info: dict) -> TrackResult:
+        nonlocal finished
+        async with semaphore:
+            result = await run_track(
+                track_info,
+                tracks_dir,
+                timeout,
+                user_id,
+                priority,
+                output_format,
+            )
+        finished += 1
+        if on_result is not None:
+            try:
+                await on_result(result, finished, max(total, len(tasks)))
+            except Exception as e:
+                logger.warning(f"Failed to report track result: {e}")
+        return result
+
+    def release_window(_: asyncio.Future) -> None:
+        window.release()
+
+    iterator = _iter_tracks(tracks_info)
+    try:
+        while True:
+            await window.acquire()
+            try:
+                track_info = await anext(iterator)
+            except StopAsyncIteration:
+                window.release()
+                break
+            task = asyncio.ensure_future(run(track_info))
+            task.add_done_callback(release_window)
+            tasks.append(task)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    total = len(tasks)
+
+    return await asyncio.gather(*tasks)
+
+
+async def _iter_tracks(
+    tracks_info: Iterable[dict] | AsyncIterable[dict],
+) -> AsyncIterator[dict]:
+    if isinstance(tracks_info, AsyncIterable):
+        async for track_info in tracks_info:
+            yield track_info
+    else:
+        for track_info in tracks_info:
+            yield track_info
+
+
+def get_job_output_format(track_count: int) -> str:
+    """
+    Choose the output format of a playlist or album.
+
+    Args:
+        track_count (int): Number of tracks in the job.
+
+    Returns:
+        str: LARGE_JOB_OUTPUT_FORMAT for jobs with more than
+        LARGE_JOB_TRACKS tracks, OUTPUT_FORMAT otherwise.
+    """
+    if LARGE_JOB_TRACKS and track_count > LARGE_JOB_TRACKS:
+        return LARGE_JOB_OUTPUT_FORMAT
+    return OUTPUT_FORMAT
+
+
+def get_results_summary(results: list[TrackResult]) -> str:
+    """
+    Describe how many tracks were processed and which of them failed.
+
+    Args:
+        results (list[TrackResult]): Results returned by process_tracks.
+
+    Returns:
+        str: A human-readable summary.
+    """
+    failed = [result for result in results if not result.ok]
+    summary = f"Downloaded {len(results) - len(failed)}/{len(results)} tracks."
+    if failed:
+        summary += "\nFailed:\n" + "\n".join(
+            f"- {result.name} ({result.error})"
+            for result in failed[:MAX_LISTED_FAILURES]
+        )
+    if len(failed) > MAX_LISTED_FAILURES:
+        summary += f"\n...and {len(failed) - MAX_LISTED_FAILURES} more."
+    return summary
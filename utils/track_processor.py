@@ -1,29 +1,103 @@
+import hashlib
 import logging
 import os
+import tempfile
 
+from config import OUTPUT_FORMAT, TAGGING_MODE
+from utils.audio_utils import DOWNLOAD_FORMATS, OUTPUT_EXTENSIONS, encode_track
 from utils.metadata_utils import add_metadata_to_track
 from utils.spotify.image_utils import download_cover_image
+from utils.track_cache import (
+    TEMP_DIR,
+    cache_track,
+    get_cached_track,
+    link_track,
+)
 from utils.youtube_utils import download_track, search_youtube
 
 logger = logging.getLogger(__name__)
 
 
-def process_track(track_info: dict, track_dir: str) -> str | None:
+def get_track_filename(
+    track_info: dict, output_format: str = OUTPUT_FORMAT
+) -> str:
+    """
+    Build the file name a track is shown to the user under.
+
+    Args:
+        track_info (dict): Information about the track.
+        output_format (str): Output format of the track.
+
+    Returns:
+        str: File name of the track, e.g. 'Intro.mp3'.
+    """
+    return f"{track_info['title']}{OUTPUT_EXTENSIONS[output_format]}"
+
+
+def get_track_path(
+    track_info: dict, track_dir: str, output_format: str = OUTPUT_FORMAT
+) -> str:
+    """
+    Build the path under which a track is stored in a job directory.
+
+    The name includes the track ID, so different tracks with the same
+    title never share a file. Use get_track_filename for the name shown
+    to the user.
+
+    Args:
+        track_info (dict): Information about the track.
+        track_dir (str): Directory of the job.
+        output_format (str): Output format of the track.
+
+    Returns:
+        str: Path to the track file.
+    """
+    # Tracks without an ID, such as local files, are told apart by
+    # their artists and title
+    track_id = (
+        track_info.get("id")
+        or hashlib.sha1(
+            f"{track_info['artists']}\0{track_info['title']}".encode()
+        ).hexdigest()[:16]
+    )
+    extension = OUTPUT_EXTENSIONS[output_format]
+    return os.path.join(
+        track_dir, f"{track_info['title']} [{track_id}]{extension}"
+    )
+
+
+def process_track(
+    track_info: dict,
+    track_dir: str,
+    youtube_track_url: str | None = None,
+    cover_data: bytes | None = None,
+    output_format: str = OUTPUT_FORMAT,
+) -> str | None:
     """
     Process a track by searching for it on YouTube, downloading the audio,
     downloading the cover image, and adding metadata to the audio file.
 
+    Tracks that were processed before are taken from the track cache,
+    skipping the search, download and tagging.
+
     Args:
         track_info (dict): Information about the track, including title,
         artists, and cover URL.
         tracks_dir (str): Directory where the downloaded tracks will be stored.
+        youtube_track_url (str | None): URL of the video to download,
+        if the search was already done by the caller.
+        cover_data (bytes | None): The cover image, if it was already
+        fetched by the caller.
+        output_format (str): One of "mp3", "m4a" or "copy".
 
     Returns:
         str | None: The path to the downloaded track if successful,
         otherwise None.
     """
+    track_id = track_info.get("id")
     track_title = track_info["title"]
     track_artists = track_info["artists"]
+    track_path = get_track_path(track_info, track_dir, output_format)
     try:
         logger.info(f"Processing: {track_artists} - {track_title}")
 
@@ -31,32 +105,68 @@ def process_track(track_info: dict, track_dir: str) -> str | None:
             logger.warning("Track not found.")
             return None
 
+        cached_path = (
+            get_cached_track(track_id, output_format) if track_id else None
+        )
+        if cached_path:
+            logger.info(f"Using cached track: {track_title}")
+            return link_track(cached_path, track_path)
+
         # Search the track
-        search_query = f"{track_title} {track_artists}"
-        youtube_track_url = search_youtube(search_query)
+        if not youtube_track_url:
+            search_query = f"{track_title} {track_artists}"
+            youtube_track_url = search_youtube(search_query, track_id)
         if not youtube_track_url:
             logger.warning(f"Could not find YouTube URL for: {track_title}")
             return None
 
-        # Download the track
-        track_path = os.path.join(track_dir, f"{track_title}.mp3")
-        track_path = download_track(youtube_track_url, track_path)
-        if not track_path:
-            logger.warning(f"Failed to download track: {track_title}")
-            return None
+        # Work in a private directory, so concurrent jobs never see
+        # or overwrite a half-processed file
+        os.makedirs(TEMP_DIR, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=TEMP_DIR) as work_dir:
+            # Download the track, converting it right away unless it is
+            # converted and tagged in one pass below. eyed3 only handles
+            # MP3 files.
+            single_pass = TAGGING_MODE == "ffmpeg" or output_format != "mp3"
+            work_path = os.path.join(
+                work_dir, f"track{OUTPUT_EXTENSIONS[output_format]}"
+            )
+            download_path = download_track(
+                youtube_track_url,
+                os.path.join(work_dir, "source") if single_pass else work_path,
+                extract_audio=not single_pass,
+                audio_format=DOWNLOAD_FORMATS[output_format],
+            )
+            if not download_path:
+                logger.warning(f"Failed to download track: {track_title}")
+                return None
+
+            # Download the cover image
+            cover_url = track_info["cover_url"]
+            if cover_data is None and cover_url:
+                cover_data = download_cover_image(cover_url)
+            elif not cover_url:
+                logger.warning(f"No cover URL for track: {track_title}")
 
-        # Download the cover image
-        cover_path = f"media/img/{track_title}.jpg"
-        cover_url = track_info["cover_url"]
-        if cover_url:
-            download_cover_image(cover_url, cover_path)
-        else:
-            logger.warning(f"No cover URL for track: {track_title}")
+            # Add metadata to the downloaded track
+            if single_pass:
+                encode_track(
+                    download_path,
+                    work_path,
+                    track_info,
+                    cover_data,
+                    output_format,
+                )
+            else:
+                add_metadata_to_track(work_path, track_info, cover_data)
 
-        # Add metadata to the downloaded track
-        add_metadata_to_track(track_path, track_info, cover_path)
+            if track_id:
+                cached_path = cache_track(track_id, work_path, output_format)
+                return link_track(cached_path, track_path)
 
-        return track_path
+            os.makedirs(track_dir, exist_ok=True)
+            os.replace(work_path, track_path)
+            return track_path
     except Exception as e:
         logger.error(f"Failed to download the track: {track_title}")
         logger.error(f"Error handling Spotify URL: {e}")
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from config import WORKER_MAX_JOBS, WORKER_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class _Worker:
+    """
+    A single worker process together with the number of jobs it ran.
+    """
+
+    def __init__(self) -> None:
+        self.executor = ProcessPoolExecutor(max_workers=1)
+        self.jobs = 0
+
+    def stop(self, kill: bool = False) -> None:
+        """
+        Stop the worker process.
+
+        Args:
+            kill (bool): Kill the process instead of letting it finish
+            its current job.
+        """
+        if kill:
+            # ProcessPoolExecutor has no public way to abort a running job
+            for process in list(self.executor._processes.values()):
+                process.kill()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class WorkerPool:
+    """
+    A pool of worker processes for blocking track work
+    (downloading, transcoding and tagging).
+
+    Every worker is a separate single-process executor, so a worker that
+    crashes or is killed after a timeout fails only its own job.
+    Workers are replaced after running max_jobs jobs to cap the memory
+    they accumulate.
+    """
+
+    def __init__(self, size: int, max_jobs: int) -> None:
+        """
+        Args:
+            size (int): Number of worker processes.
+            max_jobs (int): Number of jobs after which a worker
+            is recycled.
+        """
+        self.size = max(1, size)
+        self.max_jobs = max(1, max_jobs)
+        self._idle: asyncio.Queue[_Worker] | None = None
+        self._workers: set[_Worker] = set()
+
+    def _new_worker(self) -> _Worker:
+        worker = _Worker()
+        self._workers.add(worker)
+        return worker
+
+    def _retire_worker(self, worker: _Worker, kill: bool = False) -> None:
+        self._workers.discard(worker)
+        worker.stop(kill=kill)
+
+    async def run(
+        self, func: Callable, *args: Any, timeout: float | None = None
+    ) -> Any:
+        """
+        Run func(*args) in a worker process and await its result
+        without blocking the event loop.
+
+        Args:
+            func (Callable): A picklable module-level function.
+            *args (Any): Picklable arguments for func.
+            timeout (float | None): Maximum time in seconds to wait.
+            The worker is killed if the job takes longer.
+
+        Returns:
+            Any: The value returned by func.
+
+        Raises:
+            asyncio.TimeoutError: If the job exceeded the timeout.
+            BrokenProcessPool: If the worker process died during the job.
+        """
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for _ in range(self.size):
+                self._idle.put_nowait(self._new_worker())
+
+        worker = await self._idle.get()
+        worker.jobs += 1
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(worker.executor, func, *args)
+            return await asyncio.wait_for(future, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            logger.warning("Killing worker process after an aborted job")
+            self._retire_worker(worker, kill=True)
+            worker = self._new_worker()
+            raise
+        except BrokenProcessPool:
+            logger.error("Worker process died, starting a new one")
+            self._retire_worker(worker)
+            worker = self._new_worker()
+            raise
+        finally:
+            if worker.jobs >= self.max_jobs:
+                logger.info("Recycling worker process")
+                self._retire_worker(worker)
+                worker = self._new_worker()
+            self._idle.put_nowait(worker)
+
+    def shutdown(self) -> None:
+        """
+        Stop all worker processes.
+        """
+        for worker in list(self._workers):
+            self._retire_worker(worker, kill=True)
+        self._idle = None
+
+
+# Shared by all handlers of this process
+worker_pool = WorkerPool(size=WORKER_POOL_SIZE, max_jobs=WORKER_MAX_JOBS)
@@ -1,32 +1,135 @@
+import asyncio
+import copy
 import logging
+import math
 import os
+import re
+import sqlite3
+import time
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import Union
 
 import requests
 import yt_dlp
 
-from config import YOUTUBE_API_KEY
+from config import (
+    DOWNLOAD_CONNECTIONS,
+    DOWNLOAD_CONNECTIONS_PER_TRACK,
+    MEDIA_CACHE_DIR,
+    WEB_CONCURRENCY,
+    WORKER_POOL_SIZE,
+    YOUTUBE_API_KEY,
+    YOUTUBE_SEARCH_CACHE_TTL,
+    YOUTUBE_SEARCH_NEGATIVE_TTL,
+)
+from utils.http_session import get_session
+from utils.singleflight import SingleFlight
+from utils.storage import connect
 
 logger = logging.getLogger(__name__)
 
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"  # noqa: E501
+SEARCH_URL = "https://www.googleapis.com/youtube/v3/search"
+VIDEO_URL = "https://www.youtube.com/watch?v="
+# yt-dlp's persistent cache of deciphered player signatures
+YTDLP_CACHE_DIR = os.path.join(MEDIA_CACHE_DIR, "yt-dlp")
+# Connections per track download. All worker processes download at the
+# same time, so each gets an equal share of DOWNLOAD_CONNECTIONS.
+TRACK_CONNECTIONS = max(
+    1,
+    min(
+        DOWNLOAD_CONNECTIONS_PER_TRACK,
+        DOWNLOAD_CONNECTIONS // (WORKER_POOL_SIZE * WEB_CONCURRENCY),
+    ),
+)
+# Size of the byte ranges downloaded in parallel, small enough to stay
+# clear of YouTube's per-request throttling
+RANGE_SIZE = 4 * 1024 * 1024
+# Searches in progress, keyed by their first cache key
+_searches = SingleFlight()
 
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS youtube_searches (
+    cache_key TEXT PRIMARY KEY,
+    video_id TEXT,
+    expires_at REAL NOT NULL
+)
+"""
 
-def search_youtube(query: str) -> Union[str, None]:
+
+def _connect() -> sqlite3.Connection:
+    connection = connect()
+    connection.execute(_SCHEMA)
+    return connection
+
+
+def get_search_keys(query: str, track_id: str | None = None) -> list[str]:
     """
-    Searches YouTube for a video based on a query string.
+    Build the cache keys of a search: the Spotify track ID if known
+    and the normalized query, so the same track found through another
+    query is still a hit.
 
     Args:
         query (str): The search query string.
+        track_id (str | None): Spotify ID of the searched track.
 
     Returns:
-        Union[str, None]: The URL of the first video found,
-        or None if no video found or an error occurs.
+        list[str]: Cache keys, the most specific first.
     """
-    SEARCH_URL = "https://www.googleapis.com/youtube/v3/search"
-    VIDEO_URL = "https://www.youtube.com/watch?v="
+    normalized_query = re.sub(r"\s+", " ", query).strip().casefold()
+    keys = [f"query:{normalized_query}"]
+    if track_id:
+        keys.insert(0, f"track:{track_id}")
+    return keys
+
 
-    params = {
+def get_cached_search(keys: list[str]) -> tuple[bool, str | None]:
+    """
+    Look up a previous search result.
+
+    Args:
+        keys (list[str]): Cache keys from get_search_keys.
+
+    Returns:
+        tuple[bool, str | None]: Whether the search is cached, and the
+        video URL (None if the search was cached as "not found").
+    """
+    with closing(_connect()) as connection:
+        for key in keys:
+            row = connection.execute(
+                "SELECT video_id FROM youtube_searches "
+                "WHERE cache_key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+            if row is not None:
+                video_id = row["video_id"]
+                return True, VIDEO_URL + video_id if video_id else None
+    return False, None
+
+
+def save_search(keys: list[str], video_id: str | None) -> None:
+    """
+    Remember a search result. Searches that found nothing are kept
+    for a shorter time, so new uploads are picked up eventually.
+
+    Args:
+        keys (list[str]): Cache keys from get_search_keys.
+        video_id (str | None): The video found, or None.
+    """
+    ttl = YOUTUBE_SEARCH_CACHE_TTL if video_id else YOUTUBE_SEARCH_NEGATIVE_TTL
+    expires_at = time.time() + ttl
+    with closing(_connect()) as connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO youtube_searches "
+            "(cache_key, video_id, expires_at) VALUES (?, ?, ?)",
+            [(key, video_id, expires_at) for key in keys],
+        )
+
+
+def _get_search_params(query: str) -> dict:
+    return {
         "part": "snippet",
         "q": query,
         "type": "video",
@@ -34,11 +137,40 @@ def search_youtube(query: str) -> Union[str, None]:
         "key": YOUTUBE_API_KEY,
     }
 
-    response = requests.get(SEARCH_URL, params=params)
+
+def _get_video_id(results: dict) -> str | None:
+    if "items" in results and len(results["items"]) > 0:
+        return results["items"][0]["id"]["videoId"]
+    return None
+
+
+def search_youtube(
+    query: str, track_id: str | None = None
+) -> Union[str, None]:
+    """
+    Searches YouTube for a video based on a query string.
+
+    Results are cached, so repeated searches don't use API quota.
+
+    Args:
+        query (str): The search query string.
+        track_id (str | None): Spotify ID of the searched track,
+        used as an additional cache key.
+
+    Returns:
+        Union[str, None]: The URL of the first video found,
+        or None if no video found or an error occurs.
+    """
+    keys = get_search_keys(query, track_id)
+    is_cached, video_url = get_cached_search(keys)
+    if is_cached:
+        return video_url
+
+    response = requests.get(SEARCH_URL, params=_get_search_params(query))
     if response.status_code == 200:
-        results = response.json()
-        if "items" in results and len(results["items"]) > 0:
-            video_id = results["items"][0]["id"]["videoId"]
+        video_id = _get_video_id(response.json())
+        save_search(keys, video_id)
+        if video_id:
             return VIDEO_URL + video_id
     else:
         print(f"Error: {response.status_code}, {response.text}")
@@ -46,48 +178,347 @@ def search_youtube(query: str) -> Union[str, None]:
     return None
 
 
+async def search_youtube_async(
+    query: str, track_id: str | None = None
+) -> str | None:
+    """
+    Searches YouTube for a video based on a query string without blocking
+    the event loop, using the shared HTTP session.
+
+    Results are cached, so repeated searches don't use API quota.
+
+    Args:
+        query (str): The search query string.
+        track_id (str | None): Spotify ID of the searched track,
+        used as an additional cache key.
+
+    Returns:
+        str | None: The URL of the first video found,
+        or None if no video found or an error occurs.
+    """
+    keys = get_search_keys(query, track_id)
+    is_cached, video_url = await asyncio.to_thread(get_cached_search, keys)
+    if is_cached:
+        return video_url
+
+    # Identical searches running at the same time share one API request
+    return await _searches.do(keys[0], _fetch_search, query, keys)
+
+
+async def _fetch_search(query: str, keys: list[str]) -> str | None:
+    session = get_session()
+    async with session.get(
+        SEARCH_URL, params=_get_search_params(query)
+    ) as response:
+        if response.status != 200:
+            logger.error(
+                f"YouTube search failed: {response.status}, "
+                f"{await response.text()}"
+            )
+            return None
+        results = await response.json()
+
+    video_id = _get_video_id(results)
+    await asyncio.to_thread(save_search, keys, video_id)
+    return VIDEO_URL + video_id if video_id else None
+
+
+@dataclass
+class EngineStats:
+    """
+    Time a download engine spent extracting video information
+    versus transferring and converting the audio.
+    """
+
+    extractions: int = 0
+    extract_seconds: float = 0.0
+    transfers: int = 0
+    transfer_seconds: float = 0.0
+
+
+class DownloadEngine:
+    """
+    A long-lived yt-dlp downloader, one per worker process.
+
+    YoutubeDL instances are kept warm between tracks, so extractor
+    state, the deciphered player code and HTTP connections are reused.
+    Deciphered signatures are also cached on disk in YTDLP_CACHE_DIR,
+    where they survive worker restarts. A failed transfer is retried
+    with the information that was already extracted.
+
+    Audio that is not converted by yt-dlp is fetched in byte ranges over
+    several connections, which gets around YouTube's per-connection
+    throttling. Fragmented streams use yt-dlp's concurrent fragment
+    downloads with the same number of connections.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = YTDLP_CACHE_DIR,
+        connections: int = TRACK_CONNECTIONS,
+    ) -> None:
+        """
+        Args:
+            cache_dir (str): Directory for yt-dlp's persistent cache.
+            connections (int): Parallel connections per download.
+        """
+        self.cache_dir = cache_dir
+        self.connections = connections
+        self.stats = EngineStats()
+        self._ydls: dict[tuple[str, bool], yt_dlp.YoutubeDL] = {}
+        self._session: requests.Session | None = None
+
+    def _get_ydl(
+        self, audio_format: str, extract_audio: bool
+    ) -> yt_dlp.YoutubeDL:
+        # Format selection and postprocessors are fixed when a YoutubeDL
+        # is created, so there is one per combination
+        key = (audio_format, extract_audio)
+        ydl = self._ydls.get(key)
+        if ydl is None:
+            ydl_opts = {
+                "format": audio_format,
+                "quiet": True,
+                "noprogress": True,
+                "user_agent": USER_AGENT,
+                "cachedir": self.cache_dir,
+                "concurrent_fragment_downloads": self.connections,
+            }
+            if extract_audio:
+                ydl_opts["postprocessors"] = [
+                    {
+                        "key": "FFmpegExtractAudio",
+                        "preferredcodec": "mp3",
+                    }
+                ]
+            ydl = self._ydls[key] = yt_dlp.YoutubeDL(ydl_opts)
+        return ydl
+
+    def extract(self, ydl: yt_dlp.YoutubeDL, url: str) -> dict:
+        """
+        Extract the information of a video without downloading it.
+        """
+        started_at = time.perf_counter()
+        info = ydl.extract_info(url, download=False, process=False)
+        self.stats.extractions += 1
+        self.stats.extract_seconds += time.perf_counter() - started_at
+        return info
+
+    def transfer(
+        self, ydl: yt_dlp.YoutubeDL, info: dict, output_base: str
+    ) -> dict:
+        """
+        Download (and convert) a video whose information was extracted.
+        """
+        started_at = time.perf_counter()
+        ydl.params["outtmpl"]["default"] = f"{output_base}.%(ext)s"
+        # Format selection modifies the information in place, keep the
+        # extracted copy intact for retries
+        result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+        self.stats.transfers += 1
+        self.stats.transfer_seconds += time.perf_counter() - started_at
+        return result
+
+    def _get_session(self) -> requests.Session:
+        if self._session is None:
+            self._session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=self.connections
+            )
+            self._session.mount("https://", adapter)
+            self._session.mount("http://", adapter)
+        return self._session
+
+    def _get_size(self, url: str, headers: dict) -> int | None:
+        response = self._get_session().get(
+            url, headers={**headers, "Range": "bytes=0-0"}, timeout=30
+        )
+        response.raise_for_status()
+        content_range = response.headers.get("Content-Range", "")
+        _, _, size = content_range.rpartition("/")
+        return int(size) if size.isdigit() else None
+
+    def _download_range(
+        self, url: str, headers: dict, file_path: str, start: int, end: int
+    ) -> None:
+        response = self._get_session().get(
+            url,
+            headers={**headers, "Range": f"bytes={start}-{end}"},
+            stream=True,
+            timeout=30,
+        )
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise IOError("Server ignored the requested byte range")
+
+        offset = start
+        with response, open(file_path, "r+b") as file:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                file.seek(offset)
+                file.write(chunk)
+                offset += len(chunk)
+        if offset != end + 1:
+            raise IOError(f"Range {start}-{end} ended at byte {offset}")
+
+    def transfer_ranges(
+        self, ydl: yt_dlp.YoutubeDL, info: dict, output_base: str
+    ) -> str | None:
+        """
+        Download the selected audio format in byte ranges over parallel
+        connections.
+
+        Returns:
+            str | None: Path to the downloaded file, or None if the format
+            can't be downloaded in ranges.
+        """
+        started_at = time.perf_counter()
+        selected = ydl.process_ie_result(copy.deepcopy(info), download=False)
+        url = selected.get("url")
+        if not url or selected.get("protocol") not in ("http", "https"):
+            return None
+
+        headers = selected.get("http_headers") or {}
+        size = selected.get("filesize") or self._get_size(url, headers)
+        if not size:
+            return None
+
+        file_path = f"{output_base}.{selected['ext']}"
+        with open(file_path, "wb") as file:
+            file.truncate(size)
+        ranges = [
+            (start, min(start + RANGE_SIZE, size) - 1)
+            for start in range(0, size, RANGE_SIZE)
+        ]
+        workers = min(self.connections, len(ranges))
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(
+                        self._download_range,
+                        url,
+                        headers,
+                        file_path,
+                        start,
+                        end,
+                    )
+                    for start, end in ranges
+                ]
+                for future in futures:
+                    future.result()
+        except BaseException:
+            # yt-dlp would take a leftover file for a finished download
+            os.remove(file_path)
+            raise
+
+        self.stats.transfers += 1
+        self.stats.transfer_seconds += time.perf_counter() - started_at
+        logger.info(
+            f"Downloaded {math.ceil(size / 1024)} KiB in {len(ranges)} "
+            f"ranges over {workers} connections"
+        )
+        return file_path
+
+    def download(
+        self,
+        youtube_track_url: str,
+        output_path: str,
+        max_retries: int = 3,
+        extract_audio: bool = True,
+        audio_format: str = "bestaudio/best",
+    ) -> str | None:
+        """
+        Download the audio of a YouTube video. See download_track.
+        """
+        base, _ = os.path.splitext(output_path)
+        ydl = self._get_ydl(audio_format, extract_audio)
+        info = None
+        # Converted downloads need yt-dlp's postprocessing
+        use_ranges = not extract_audio and self.connections > 1
+        extract_seconds = self.stats.extract_seconds
+        transfer_seconds = self.stats.transfer_seconds
+
+        for attempt in range(max_retries):
+            try:
+                if info is None:
+                    info = self.extract(ydl, youtube_track_url)
+                file_path = None
+                if use_ranges:
+                    try:
+                        file_path = self.transfer_ranges(ydl, info, base)
+                    except (requests.RequestException, OSError) as e:
+                        logger.warning(f"Ranged download failed: {e}")
+                    if file_path is None:
+                        use_ranges = False
+                if file_path is None:
+                    result = self.transfer(ydl, info, base)
+                    file_path = result["requested_downloads"][0]["filepath"]
+                logger.info(
+                    f"Download successful on attempt {attempt + 1} "
+                    "(extraction "
+                    f"{self.stats.extract_seconds - extract_seconds:.1f}s, "
+                    "transfer "
+                    f"{self.stats.transfer_seconds - transfer_seconds:.1f}s)"
+                )
+                if extract_audio:
+                    return f"{base}.mp3"
+                return file_path
+            except yt_dlp.utils.DownloadError as e:
+                logger.error(f"Error downloading the track: {e}")
+                if attempt >= max_retries - 1:
+                    logger.error(
+                        f"Failed to download the track after {max_retries} attempts."  # noqa: E501
+                    )
+                    raise
+
+        return None
+
+
+# Created on first use in each worker process
+_engine: DownloadEngine | None = None
+
+
+def get_download_engine() -> DownloadEngine:
+    """
+    Get the download engine of the current process.
+
+    Returns:
+        DownloadEngine: The process-wide download engine.
+    """
+    global _engine
+    if _engine is None:
+        _engine = DownloadEngine()
+    return _engine
+
+
 def download_track(
-    youtube_track_url: str, output_path: str, max_retries: int = 3
+    youtube_track_url: str,
+    output_path: str,
+    max_retries: int = 3,
+    extract_audio: bool = True,
+    audio_format: str = "bestaudio/best",
 ) -> str | None:
     """
     Downloads the audio track of a YouTube video and saves it as an MP3 file.
 
+    Uses the download engine of the current process.
+
     Args:
         youtube_track_url (str): The URL of the YouTube video to download.
         output_path (str): The file path to save the downloaded audio track.
         max_retries (int): The maximum number of retries if
         the download fails. Defaults to 3.
+        extract_audio (bool): Convert the download to MP3. If False, the
+        audio is saved as downloaded, with the source's extension.
+        audio_format (str): yt-dlp format selection.
 
     Returns:
-        Union[str, None]: The file path of the downloaded MP3 file,
+        Union[str, None]: The file path of the downloaded file,
         or None if the download fails.
     """
-    base, _ = os.path.splitext(output_path)  # Remove any existing extension
-    ydl_opts = {
-        "format": "bestaudio/best",
-        "outtmpl": f"{base}.%(ext)s",
-        "quiet": True,
-        "user_agent": USER_AGENT,
-        "postprocessors": [
-            {
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-            }
-        ],
-    }
-
-    for attempt in range(max_retries):
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download(youtube_track_url)
-            logger.info(f"Download successful on attempt {attempt + 1}")
-            return f"{base}.mp3"
-        except yt_dlp.utils.DownloadError as e:
-            logger.error(f"Error downloading the track: {e}")
-            if attempt >= max_retries - 1:
-                logger.error(
-                    f"Failed to download the track after {max_retries} attempts."  # noqa: E501
-                )
-                raise
-
-    return None
+    return get_download_engine().download(
+        youtube_track_url,
+        output_path,
+        max_retries,
+        extract_audio,
+        audio_format,
+    )